@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк распознавания QR с фото (bot/qr_decoder.py) на синтетическом корпусе.
+
+Корпус строится локально: настоящие данные QR (v2 и v1, как их собирает
+generate_qr_payload в web/main.py) рендерятся профилем киоска, код
+кладётся на «экран» в кадре и портится типичными для съёмки киоска
+искажениями — размытие, перспектива, пережатие JPEG, блик, муар,
+слабое освещение. Каждый вариант конвейера распознавания прогоняется
+по всему корпусу; для него печатаются доля успехов, p50/p95 времени
+на фото и память.
+
+Каждый вариант идёт в отдельном процессе, память — пик RSS процесса
+(getrusage, ru_maxrss): он видит и буферы Pillow/NumPy/OpenCV вне кучи
+Python, которых не видит tracemalloc. Печатается пик и его прирост
+за прогон относительно процесса с загруженным корпусом.
+
+Варианты:
+    legacy      — как было: pyzbar по всему кадру полного размера;
+    ladder      — decode_photo со всеми стратегиями по порядку;
+    only:<имя>  — лестница разрешений с одной стратегией;
+    race        — пул с гонкой стратегий (--race N процессов; память
+                  процессов пула не измеряется).
+
+Запуск из корня проекта:
+    python benchmarks/qr_decode_bench.py [--samples 10] [--size 1280x960] [--race 4]
+"""
+
+import argparse
+import asyncio
+import io
+import multiprocessing
+import multiprocessing.forkserver
+import resource
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+from PIL import Image
+from pyzbar.pyzbar import decode
+
+# Корень проекта в sys.path, чтобы импортировать bot, web и utils
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bot import qr_decoder  # noqa: E402
+from benchmarks.qr_render_bench import payload_v1, payload_v2  # noqa: E402
+from web import qr_render  # noqa: E402
+
+# Качество JPEG, с которым Telegram отдаёт фото
+TELEGRAM_JPEG_QUALITY = 87
+
+# Варианты идут в процессах от forkserver, запущенного до сборки корпуса:
+# ru_maxrss переживает exec (spawn) и достался бы от родителя с кадрами
+# корпуса, а процесс от fork сервера начинает с его небольшого пика.
+# Сервер заранее импортирует распознавание, как пул бота
+_MP_CONTEXT = multiprocessing.get_context("forkserver")
+_MP_CONTEXT.set_forkserver_preload([qr_decoder.__name__])
+
+
+def render_code(qr_full):
+    """QR в оттенках серого, как его показывает киоск"""
+    png = qr_render.render_png(qr_full, "kiosk")
+    return np.asarray(Image.open(io.BytesIO(png)).convert("L"))
+
+
+def place_on_screen(code, size, rng):
+    """Кадр size: код на светлом экране посреди тёмного фона, со случайным масштабом и сдвигом"""
+    width, height = size
+    frame = rng.normal(70, 15, (height, width)).clip(0, 255).astype(np.uint8)
+    side = int(min(width, height) * rng.uniform(0.35, 0.6))
+    screen = int(side * 1.3)
+    x = int(rng.uniform(0, width - screen))
+    y = int(rng.uniform(0, height - screen))
+    frame[y:y + screen, x:x + screen] = 235
+    offset = (screen - side) // 2
+    frame[y + offset:y + offset + side, x + offset:x + offset + side] = cv2.resize(
+        code, (side, side), interpolation=cv2.INTER_AREA
+    )
+    return frame
+
+
+def blur(img, rng):
+    """Смаз при съёмке с рук: линейное размытие под случайным углом"""
+    length = int(rng.uniform(5, 11))
+    kernel = np.zeros((length, length), np.float32)
+    kernel[length // 2, :] = 1 / length
+    rotation = cv2.getRotationMatrix2D((length / 2 - 0.5, length / 2 - 0.5), rng.uniform(0, 180), 1)
+    kernel = cv2.warpAffine(kernel, rotation, (length, length))
+    return cv2.filter2D(img, -1, kernel / max(kernel.sum(), 1e-6))
+
+
+def perspective(img, rng):
+    """Съёмка киоска сбоку: углы кадра сдвинуты до 18% стороны"""
+    height, width = img.shape
+    src = np.float32([[0, 0], [width, 0], [width, height], [0, height]])
+    jitter = rng.uniform(0, 0.18, (4, 2)) * [width, height]
+    dst = np.float32(src + jitter * [[1, 1], [-1, 1], [-1, -1], [1, -1]])
+    matrix = cv2.getPerspectiveTransform(src, dst)
+    return cv2.warpPerspective(img, matrix, (width, height), borderValue=70)
+
+
+def recompress(img, rng):
+    """Фото, пересланное несколько раз: многократное пережатие JPEG с низким качеством"""
+    for _ in range(3):
+        buf = io.BytesIO()
+        Image.fromarray(img).save(buf, "JPEG", quality=int(rng.uniform(25, 45)))
+        img = np.asarray(Image.open(buf).convert("L"))
+    return img
+
+
+def glare(img, rng):
+    """Блик лампы на экране: яркое пятно поверх части кода"""
+    height, width = img.shape
+    yy, xx = np.mgrid[0:height, 0:width]
+    cx, cy = rng.uniform(0.3, 0.7) * width, rng.uniform(0.3, 0.7) * height
+    radius = rng.uniform(0.15, 0.25) * min(width, height)
+    spot = np.exp(-((xx - cx) ** 2 + (yy - cy) ** 2) / (2 * radius ** 2))
+    return (img * (1 - 0.5 * spot) + 255 * 0.5 * spot).clip(0, 255).astype(np.uint8)
+
+
+def moire(img, rng):
+    """Муар от пиксельной сетки экрана: интерференционные полосы"""
+    height, width = img.shape
+    yy, xx = np.mgrid[0:height, 0:width]
+    angle = rng.uniform(0, np.pi)
+    period = rng.uniform(3, 6)
+    waves = np.sin((xx * np.cos(angle) + yy * np.sin(angle)) * 2 * np.pi / period)
+    return (img * (1 + 0.2 * waves)).clip(0, 255).astype(np.uint8)
+
+
+def low_light(img, rng):
+    """Тёмное помещение: низкая яркость и шум сенсора"""
+    dark = img * rng.uniform(0.2, 0.35)
+    noise = rng.normal(0, 6, img.shape)
+    return (dark + noise).clip(0, 255).astype(np.uint8)
+
+
+DISTORTIONS = {
+    "чистое": lambda img, rng: img,
+    "размытие": blur,
+    "перспектива": perspective,
+    "пережатие": recompress,
+    "блик": glare,
+    "муар": moire,
+    "темнота": low_light,
+}
+
+
+def build_corpus(samples, size, seed):
+    """[(искажение, ожидаемые данные, байты JPEG)]"""
+    rng = np.random.default_rng(seed)
+    payloads = [payload_v2(), payload_v1()]
+    codes = {qr_full: render_code(qr_full) for qr_full in payloads}
+    corpus = []
+    for name, distort in DISTORTIONS.items():
+        for i in range(samples):
+            qr_full = payloads[i % len(payloads)]
+            img = distort(place_on_screen(codes[qr_full], size, rng), rng)
+            buf = io.BytesIO()
+            Image.fromarray(img).save(buf, "JPEG", quality=TELEGRAM_JPEG_QUALITY)
+            corpus.append((name, qr_full.encode(), buf.getvalue()))
+    return corpus
+
+
+def legacy_decode(data):
+    """Как было до пула: весь кадр полного размера в pyzbar"""
+    return None, [d.data for d in decode(Image.open(io.BytesIO(data)))]
+
+
+def pipelines():
+    variants = {
+        "legacy": legacy_decode,
+        "ladder": qr_decoder.decode_photo,
+    }
+    for name in qr_decoder.STRATEGY_ORDER:
+        variants[f"only:{name}"] = lambda data, name=name: qr_decoder.decode_photo(data, (name,))
+    return variants
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def max_rss_mb():
+    """Пик RSS текущего процесса, МБ (ru_maxrss: КБ в Linux, байты в macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def _run_variant_child(name, corpus):
+    """Прогон варианта в отдельном процессе: результаты, пик RSS и его прирост, МБ"""
+    run = pipelines()[name]
+    baseline = max_rss_mb()
+    results = {}
+    for distortion, expected, data in corpus:
+        started = time.perf_counter()
+        _, decoded = run(data)
+        elapsed = (time.perf_counter() - started) * 1000
+        ok, total, times = results.get(distortion, (0, 0, []))
+        results[distortion] = (ok + (expected in decoded), total + 1, times + [elapsed])
+    peak = max_rss_mb()
+    return results, (peak, peak - baseline)
+
+
+def run_variant(name, corpus):
+    """{искажение: (успехов, всего, [мс])} и память (пик, прирост), МБ.
+
+    Свежий процесс на каждый вариант: ru_maxrss — пик за всю жизнь
+    процесса, в общем процессе он достался бы от предыдущего варианта.
+    """
+    with _MP_CONTEXT.Pool(1) as pool:
+        return pool.apply(_run_variant_child, (name, corpus))
+
+
+def run_race(workers, corpus):
+    """Гонка стратегий в пуле процессов (только время и доля успехов)"""
+    pool = qr_decoder.QRDecoderPool(workers=workers, timeout=60)
+    pool.start()
+
+    async def decode_all():
+        results = {}
+        for distortion, expected, data in corpus:
+            started = time.perf_counter()
+            _, decoded = await pool.decode(data)
+            elapsed = (time.perf_counter() - started) * 1000
+            ok, total, times = results.get(distortion, (0, 0, []))
+            results[distortion] = (ok + (expected in decoded), total + 1, times + [elapsed])
+        return results
+
+    try:
+        return asyncio.run(decode_all()), None
+    finally:
+        pool.shutdown()
+
+
+def report(name, results, memory_mb):
+    if memory_mb is None:
+        memory = "память не измерялась"
+    else:
+        memory = f"пик RSS {memory_mb[0]:.1f} МБ, за прогон +{memory_mb[1]:.1f} МБ"
+    print(f"\n=== {name} ({memory}) ===")
+    print(f"{'искажение':<14}{'успех':>10}{'p50, мс':>10}{'p95, мс':>10}")
+    all_ok = all_total = 0
+    all_times = []
+    for distortion, (ok, total, times) in results.items():
+        all_ok, all_total, all_times = all_ok + ok, all_total + total, all_times + times
+        print(f"{distortion:<14}{ok:>5}/{total:<4}{percentile(times, 0.5):>10.0f}{percentile(times, 0.95):>10.0f}")
+    print(
+        f"{'итого':<14}{all_ok:>5}/{all_total:<4}"
+        f"{percentile(all_times, 0.5):>10.0f}{percentile(all_times, 0.95):>10.0f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", type=int, default=10, help="фото на каждое искажение")
+    parser.add_argument("--size", default="1280x960", help="размер кадра, ШxВ (1280 — крупнейшее фото Telegram)")
+    parser.add_argument("--seed", type=int, default=1, help="зерно генератора корпуса")
+    parser.add_argument("--only", help="варианты через запятую (по умолчанию все)")
+    parser.add_argument("--race", type=int, default=0, help="процессов для варианта race (0 — не запускать)")
+    args = parser.parse_args()
+
+    size = tuple(int(side) for side in args.size.lower().split("x"))
+    multiprocessing.forkserver.ensure_running()
+    corpus = build_corpus(args.samples, size, args.seed)
+    print(f"Корпус: {len(corpus)} фото {size[0]}x{size[1]}, {len(DISTORTIONS)} искажений")
+
+    variants = pipelines()
+    selected = args.only.split(",") if args.only else list(variants)
+    for name in selected:
+        if name == "race":
+            continue
+        results, memory_mb = run_variant(name, corpus)
+        report(name, results, memory_mb)
+    if args.race or "race" in selected:
+        results, memory_mb = run_race(max(args.race, 2), corpus)
+        report(f"race ({max(args.race, 2)} процесса)", results, memory_mb)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Микробенчмарк движков рендера QR (web/qr_render.py).
+
+Сравнивает время рендера и размер ответа для реальных данных QR:
+компактного v2 и прежнего v1 (base64 JSON с названием филиала).
+
+Запуск из корня проекта:
+    python benchmarks/qr_render_bench.py [--repeat 200]
+"""
+
+import argparse
+import base64
+import io
+import json
+import sys
+import time
+from pathlib import Path
+
+import qrcode
+
+# Корень проекта в sys.path, чтобы импортировать web и utils
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils import qr_payload  # noqa: E402
+from web import qr_render  # noqa: E402
+
+SECRET = "bench_secret"
+BRANCH_ID = 3
+BRANCH_NAME = "Гирудомед на Баумана"
+TIME_WINDOW = 59742357
+
+
+def payload_v1():
+    payload = {
+        "branch_id": BRANCH_ID,
+        "branch_name": BRANCH_NAME,
+        "timestamp": TIME_WINDOW,
+        "expires": TIME_WINDOW * 30 + 120,
+        "signature": qr_payload.sign_v1(SECRET, BRANCH_ID, TIME_WINDOW),
+        "generated_at": TIME_WINDOW * 30,
+    }
+    data = base64.urlsafe_b64encode(json.dumps(payload, ensure_ascii=False).encode()).decode()
+    return f"{qr_payload.QR_PREFIX}{data}"
+
+
+def payload_v2():
+    return f"{qr_payload.QR_PREFIX}{qr_payload.encode_v2(SECRET, BRANCH_ID, TIME_WINDOW)}"
+
+
+def legacy_png(qr_full):
+    """Как было до движков: qrcode.make() + PNG с PIL-фабрикой по умолчанию"""
+    out = io.BytesIO()
+    qrcode.make(qr_full).save(out, "PNG")
+    return out.getvalue()
+
+
+ENGINES = {
+    "qrcode.make (было)": legacy_png,
+    "png/default": lambda d: qr_render.render_png(d, "default"),
+    "png/kiosk": lambda d: qr_render.render_png(d, "kiosk"),
+    "png/robust": lambda d: qr_render.render_png(d, "robust"),
+    "svg": qr_render.render_svg,
+    "matrix (json)": lambda d: json.dumps(qr_render.render_matrix(d)).encode(),
+}
+
+
+def bench(render, qr_full, repeat):
+    render(qr_full)  # прогрев
+    started = time.perf_counter()
+    for _ in range(repeat):
+        output = render(qr_full)
+    elapsed = (time.perf_counter() - started) / repeat
+    return elapsed * 1000, len(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=200, help="рендеров на замер")
+    args = parser.parse_args()
+
+    for label, qr_full in (("v2", payload_v2()), ("v1", payload_v1())):
+        version, modules = qr_render.build_modules(qr_full)
+        print(f"\n=== Данные {label}: {len(qr_full)} символов, QR версии {version} ({len(modules)}x{len(modules)}) ===")
+        print(f"{'движок':<22}{'мс/рендер':>12}{'байт':>10}")
+        for name, render in ENGINES.items():
+            ms, size = bench(render, qr_full, args.repeat)
+            print(f"{name:<22}{ms:>12.3f}{size:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,16 @@
 #bot.py
 import os
 import sys
+import asyncio
 import json
-import base64
-import hmac
-import hashlib
 import logging
+import tempfile
+from collections import Counter
 from datetime import datetime, timezone, timedelta
 from dotenv import load_dotenv
 from telegram import Update
 from telegram.ext import ApplicationBuilder, ContextTypes, CommandHandler, MessageHandler, filters
 from supabase import create_client, Client
-from PIL import Image
-from pyzbar.pyzbar import decode
 from pathlib import Path
 
 # Добавляем корневую директорию проекта в sys.path для корректных импортов
@@ -22,6 +20,14 @@ sys.path.insert(0, str(project_root))
 
 # Теперь импортируем utils
 import utils.httpx_proxy_patch
+from utils.branch_catalog import BranchCatalog
+from utils.db_async import db_call, db_execute
+from utils.shift_state import ShiftStateCache
+from utils.user_directory import UserDirectory
+from utils.lru_cache import LRUCache
+from utils import qr_payload
+from bot.qr_decoder import STRATEGY_ORDER, decoder_pool
+from bot.strategy_stats import StrategyStats
 
 # Загрузка переменных окружения (только если файл .env доступен)
 try:
@@ -47,6 +53,8 @@ logging.basicConfig(
 
 TELEGRAM_TOKEN = os.environ.get("TELEGRAM_TOKEN")
 QR_SECRET = os.environ.get("QR_SECRET")
+# HTTPS-адрес страницы /scanner веб-приложения: кнопка сканера Mini App в меню бота
+SCANNER_WEBAPP_URL = os.environ.get("SCANNER_WEBAPP_URL")
 SUPABASE_URL = os.environ.get("NEXT_PUBLIC_SUPABASE_URL")
 SUPABASE_KEY = os.environ.get("NEXT_PUBLIC_SUPABASE_ANON_KEY")
 
@@ -54,17 +62,28 @@ if not all([TELEGRAM_TOKEN, QR_SECRET, SUPABASE_URL, SUPABASE_KEY]):
     raise Exception("Не хватает переменных окружения в .env для запуска бота и подключения к Supabase!")
 
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+branch_catalog = BranchCatalog(supabase)
+shift_state = ShiftStateCache(supabase)
+user_directory = UserDirectory(supabase)
 
-def verify_signature(branch_id, time_window, signature):
+async def catalog_call(func, *args):
+    """Вызов справочника филиалов: из памяти — сразу, загрузка из Supabase — в пуле потоков базы"""
+    if branch_catalog.ready():
+        return func(*args)
+    return await db_call(func, *args)
+
+def verify_signature(branch_id, time_window, signature, version=1):
     if not QR_SECRET:
         logging.error("QR_SECRET не установлен")
         return False
     
     try:
-        msg = f"{branch_id}:{time_window}".encode()
-        secret = QR_SECRET.encode()
-        expected = hmac.new(secret, msg, hashlib.sha256).hexdigest()
-        return hmac.compare_digest(signature, expected)
+        return qr_payload.verify(QR_SECRET, {
+            "version": version,
+            "branch_id": branch_id,
+            "timestamp": time_window,
+            "signature": signature,
+        })
     except Exception as e:
         logging.exception("Ошибка проверки подписи QR-кода:")
         return False
@@ -73,6 +92,13 @@ from telegram import InlineKeyboardMarkup, InlineKeyboardButton
 
 ADMIN_USERNAME = "gayazking"
 
+def scanner_keyboard_rows():
+    """Ряд с кнопкой сканера Mini App, если он настроен (SCANNER_WEBAPP_URL)"""
+    if not SCANNER_WEBAPP_URL:
+        return []
+    from telegram import KeyboardButton, WebAppInfo
+    return [[KeyboardButton("📷 Сканировать QR", web_app=WebAppInfo(url=SCANNER_WEBAPP_URL))]]
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.message.from_user
     user_id = user.id
@@ -82,13 +108,12 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.message.chat.id
 
     # Проверка: есть ли пользователь в users и одобрен ли он
-    user_query = supabase.table("users").select("*").eq("telegram_id", user_id).execute()
-    user_data = user_query.data[0] if user_query.data and len(user_query.data) > 0 else None
+    user_data = await user_directory.get(user_id)
 
     # Если это суперпользователь (по username), всегда разрешаем и обновляем/создаём запись
     if username == ADMIN_USERNAME:
         if not user_data:
-            supabase.table("users").insert({
+            await db_execute(supabase.table("users").insert({
                 "telegram_id": user_id,
                 "first_name": first_name,
                 "last_name": last_name,
@@ -98,9 +123,9 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 "role": "superuser",
                 "is_superuser": True,
                 "can_approve_registrations": True
-            }).execute()
+            }))
         else:
-            supabase.table("users").update({
+            await db_execute(supabase.table("users").update({
                 "first_name": first_name,
                 "last_name": last_name,
                 "chat_id": chat_id,
@@ -108,11 +133,12 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 "role": "superuser",
                 "is_superuser": True,
                 "can_approve_registrations": True
-            }).eq("telegram_id", user_id).execute()
+            }).eq("telegram_id", user_id))
+        user_directory.invalidate()
         
         # Меню для суперпользователя
         from telegram import ReplyKeyboardMarkup, KeyboardButton
-        keyboard = ReplyKeyboardMarkup([
+        keyboard = ReplyKeyboardMarkup(scanner_keyboard_rows() + [
             ["📊 Моя статистика", "📋 Меню"],
             ["👑 Админ-панель", "❓ Помощь"]
         ], resize_keyboard=True)
@@ -125,7 +151,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Если пользователь есть и одобрен
     if user_data and user_data.get("status") == "approved":
         from telegram import ReplyKeyboardMarkup, KeyboardButton
-        keyboard = ReplyKeyboardMarkup([
+        keyboard = ReplyKeyboardMarkup(scanner_keyboard_rows() + [
             ["📊 Моя статистика", "📋 Меню"],
             ["❓ Помощь"]
         ], resize_keyboard=True)
@@ -165,8 +191,7 @@ async def contact_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     phone = update.message.contact.phone_number if update.message.contact else None
 
     # Проверка: есть ли пользователь в users
-    user_query = supabase.table("users").select("*").eq("telegram_id", user_id).execute()
-    user_data = user_query.data[0] if user_query.data and len(user_query.data) > 0 else None
+    user_data = await user_directory.get(user_id)
 
     if user_data:
         await update.message.reply_text("Вы уже отправили заявку или зарегистрированы.")
@@ -356,7 +381,7 @@ async def handle_registration_confirmation(query, context):
             return
         
         # Проверить, не существует ли уже пользователь с таким telegram_id
-        existing_user = supabase.table("users").select("*").eq("telegram_id", reg_data['telegram_id']).execute()
+        existing_user = await db_execute(supabase.table("users").select("*").eq("telegram_id", reg_data['telegram_id']))
         if existing_user.data:
             await query.edit_message_text("❌ Пользователь с таким ID уже зарегистрирован. Ожидайте подтверждения администратора.")
             context.user_data.pop('registration_data', None)
@@ -364,7 +389,8 @@ async def handle_registration_confirmation(query, context):
         
         # Сохранить пользователя в базу данных
         try:
-            supabase.table("users").insert(reg_data).execute()
+            await db_execute(supabase.table("users").insert(reg_data))
+            user_directory.invalidate()
         except Exception as db_error:
             logging.exception("Ошибка вставки пользователя в базу данных:")
             await query.edit_message_text("❌ Ошибка сохранения данных в базе. Попробуйте зарегистрироваться заново с команды /start")
@@ -372,8 +398,7 @@ async def handle_registration_confirmation(query, context):
             return
         
         # Найти chat_id админа (по username)
-        admin_query = supabase.table("users").select("*").eq("username", ADMIN_USERNAME).execute()
-        admin = admin_query.data[0] if admin_query.data and len(admin_query.data) > 0 else None
+        admin = await user_directory.by_username(ADMIN_USERNAME)
         admin_chat_id = admin["chat_id"] if admin and admin.get("chat_id") else None
 
         # Кнопки для подтверждения/отклонения
@@ -493,10 +518,8 @@ async def handle_registration_restart(query, context):
 async def get_last_event_type(user_id):
     """Получить тип последнего события пользователя"""
     try:
-        result = supabase.table("time_events").select("event_type").eq("telegram_id", user_id).order("event_time", desc=True).limit(1).execute()
-        if result.data and len(result.data) > 0:
-            return result.data[0]["event_type"]
-        return None
+        state = await shift_state.get(user_id)
+        return state["last_event_type"]
     except Exception as e:
         logging.exception("Ошибка получения последнего события:")
         return None
@@ -504,14 +527,8 @@ async def get_last_event_type(user_id):
 async def get_last_arrival_branch(user_id):
     """Получить филиал последнего прихода без соответствующего ухода"""
     try:
-        result = supabase.table("time_events").select("*").eq("telegram_id", user_id).eq("event_type", "arrival").order("event_time", desc=True).limit(1).execute()
-        if result.data and len(result.data) > 0:
-            arrival_event = result.data[0]
-            # Проверить, есть ли событие ухода после этого прихода
-            departure_result = supabase.table("time_events").select("*").eq("telegram_id", user_id).eq("event_type", "departure").gt("event_time", arrival_event["event_time"]).limit(1).execute()
-            if not departure_result.data:
-                return arrival_event["branch_id"]
-        return None
+        arrival_event = (await shift_state.get(user_id))["open_arrival"]
+        return arrival_event["branch_id"] if arrival_event else None
     except Exception as e:
         logging.exception("Ошибка получения филиала последнего прихода:")
         return None
@@ -519,12 +536,11 @@ async def get_last_arrival_branch(user_id):
 async def check_user_authorization(user_id):
     """Проверить авторизацию пользователя"""
     try:
-        user_query = supabase.table("users").select("*").eq("telegram_id", user_id).execute()
-        if not user_query.data:
+        user_data = await user_directory.get(user_id)
+        if not user_data:
             logging.info(f"Пользователь {user_id} не найден в базе данных")
             return False
         
-        user_data = user_query.data[0]
         is_authorized = user_data.get("status") == "approved"
         logging.info(f"Проверка авторизации пользователя {user_id}: статус={user_data.get('status')}, авторизован={is_authorized}")
         return is_authorized
@@ -632,11 +648,11 @@ async def handle_admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return
     
     # Получить статистику пользователей
-    users_result = supabase.table("users").select("*").execute()
-    total_users = len(users_result.data) if users_result.data else 0
-    pending_users = len([u for u in users_result.data if u.get("status") == "pending"]) if users_result.data else 0
-    approved_users = len([u for u in users_result.data if u.get("status") == "approved"]) if users_result.data else 0
-    admins = len([u for u in users_result.data if u.get("role") == "admin"]) if users_result.data else 0
+    users = await user_directory.all()
+    total_users = len(users) if users else 0
+    pending_users = len([u for u in users if u.get("status") == "pending"]) if users else 0
+    approved_users = len([u for u in users if u.get("status") == "approved"]) if users else 0
+    admins = len([u for u in users if u.get("role") == "admin"]) if users else 0
     
     keyboard = InlineKeyboardMarkup([
         [
@@ -701,7 +717,7 @@ async def generate_statistics_report(user_id, days):
         start_date = end_date - timedelta(days=days)
         
         # Получить все события пользователя за период
-        events_result = supabase.table("time_events").select("*").eq("telegram_id", user_id).gte("event_time", start_date.isoformat()).lte("event_time", end_date.isoformat()).order("event_time", desc=False).execute()
+        events_result = await db_execute(supabase.table("time_events").select("*").eq("telegram_id", user_id).gte("event_time", start_date.isoformat()).lte("event_time", end_date.isoformat()).order("event_time", desc=False))
         
         if not events_result.data:
             return f"📊 Отчет за {days} дней\n\nДанных за указанный период не найдено."
@@ -833,26 +849,28 @@ async def handle_qr(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Отправьте QR-код, полученный на терминале.")
         return
 
-    base64_data = text[len("/qr_"):]
     try:
-        json_str = base64.urlsafe_b64decode(base64_data.encode()).decode()
-        data = json.loads(json_str)
+        # Поддерживаются оба формата: v1 (base64 JSON) и компактный v2
+        data = qr_payload.parse(text[len(qr_payload.QR_PREFIX):])
     except Exception as e:
         logging.exception("Ошибка декодирования QR:")
         await update.message.reply_text("Ошибка в QR-коде (не удалось декодировать данные).")
         return
 
+    version = data.get("version")
     branch_id = data.get("branch_id")
-    branch_name = data.get("branch_name")
     timestamp = data.get("timestamp")
     expires = data.get("expires")
     signature = data.get("signature")
 
     # Проверка подписи
-    if not verify_signature(branch_id, timestamp, signature):
+    if not verify_signature(branch_id, timestamp, signature, version):
         await update.message.reply_text("QR-код недействителен (ошибка подписи).")
         return
 
+    # В v2 названия филиала нет — берём из справочника
+    branch_name = data.get("branch_name") or await catalog_call(branch_catalog.name, branch_id, f"Филиал {branch_id}")
+
     # Проверка срока действия (60 секунд) - используем московское время
     now_ts = get_moscow_timestamp()
     logging.info(f"Проверка времени (МСК): текущее={now_ts}, истекает={expires}, разница={now_ts - expires}")
@@ -862,6 +880,11 @@ async def handle_qr(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(f"Этот QR-код уже истёк. Попробуйте еще раз.\nТекущее время (МСК): {now_ts}, код истёк: {expires}, разница: {now_ts - expires} сек")
         return
 
+    # Киоски получают коды на несколько окон вперёд — код действует только с начала своего окна
+    if qr_payload.not_yet_valid(timestamp, now_ts):
+        await update.message.reply_text("Этот QR-код ещё не действует. Отсканируйте код, который сейчас на экране терминала.")
+        return
+
     # Сохранить данные QR в контексте для последующего использования
     context.user_data['pending_qr'] = {
         "telegram_id": user_id,
@@ -916,8 +939,9 @@ async def handle_qr(update: Update, context: ContextTypes.DEFAULT_TYPE):
         last_arrival_branch = await get_last_arrival_branch(user_id)
         if last_arrival_branch and last_arrival_branch != branch_id:
             # Получить название филиала прихода
-            branches_result = supabase.table("branches").select("name").eq("id", last_arrival_branch).execute()
-            arrival_branch_name = branches_result.data[0]["name"] if branches_result.data else f"филиал {last_arrival_branch}"
+            arrival_branch_name = await catalog_call(
+                branch_catalog.name, last_arrival_branch, f"филиал {last_arrival_branch}"
+            )
             await update.message.reply_text(
                 f"❌ Ошибка: Вы пришли в филиал '{arrival_branch_name}', поэтому уход должен быть зафиксирован с QR-кода того же филиала.\n\n"
                 f"Текущий QR-код от филиала '{branch_name}' не подходит для ухода."
@@ -938,13 +962,163 @@ async def handle_qr(update: Update, context: ContextTypes.DEFAULT_TYPE):
             reply_markup=keyboard
         )
 
+# Первая попытка — наименьший вариант фото с длинной стороной не меньше этой
+PHOTO_FIRST_MIN_SIDE = int(os.environ.get("PHOTO_FIRST_MIN_SIDE", "800"))
+# Длинная сторона варианта, на котором распознан код → число фото
+photo_size_stats = Counter()
+# Bot API отдаёт боту файлы не больше 20 МБ
+TELEGRAM_DOWNLOAD_LIMIT = 20 * 1024 * 1024
+# Видео длиннее этого не распознаются: QR-код снимают коротким клипом
+QR_VIDEO_MAX_DURATION = int(os.environ.get("QR_VIDEO_MAX_DURATION", "30"))
+# Сообщения, в которых ищется QR-код: фото, изображения файлом (без пережатия), видео и кружки
+QR_MEDIA_FILTER = filters.PHOTO | filters.Document.IMAGE | filters.VIDEO | filters.VIDEO_NOTE
+# Результаты распознавания по file_unique_id: сотрудники часто пересылают то же фото
+photo_decode_cache = LRUCache(
+    max_entries=int(os.environ.get("PHOTO_CACHE_SIZE", "256")),
+    ttl=int(os.environ.get("PHOTO_CACHE_TTL", "600")),
+)
+# Какие стратегии распознавания срабатывают у какого филиала — их пробуем первыми
+strategy_stats = StrategyStats(STRATEGY_ORDER)
+# telegram_id → филиал из последнего распознанного фото (подсказка для порядка стратегий)
+photo_branch_hints = {}
+
+def payload_branch(data):
+    """branch_id из данных /qr_ кода (bytes) или None"""
+    text = data.decode("utf-8", "replace")
+    if not text.startswith(qr_payload.QR_PREFIX):
+        return None
+    try:
+        return qr_payload.parse(text[len(qr_payload.QR_PREFIX):]).get("branch_id")
+    except ValueError:
+        return None
+
+async def photo_branch_hint(user_id):
+    """Филиал, у которого сотрудник, скорее всего, снимает код: прошлое фото или открытый приход"""
+    branch_id = photo_branch_hints.get(user_id)
+    if branch_id is None:
+        open_arrival = (await shift_state.get(user_id))["open_arrival"]
+        branch_id = open_arrival["branch_id"] if open_arrival else None
+    return branch_id
+
+def photo_attempts(photos):
+    """Варианты фото (PhotoSize) для распознавания по порядку: средний, затем самый большой"""
+    largest = photos[-1]
+    first = next(
+        (p for p in photos if max(p.width, p.height) >= PHOTO_FIRST_MIN_SIDE),
+        largest,
+    )
+    return [first] if first is largest else [first, largest]
+
+async def decode_photo_sizes(photos, branch_hint):
+    """Распознать фото сообщения → (стратегия, данные кодов, (ширина, высота))"""
+    # Сначала средний размер фото, самый большой — только если код не прочитан
+    strategy, decoded = None, []
+    for photo_size in photo_attempts(photos):
+        photo_file = await photo_size.get_file()
+        
+        # Скачать фото сразу в память, без временных файлов
+        photo_bytes = bytes(await photo_file.download_as_bytearray())
+        logging.info(f"Фото скачано: {photo_size.width}x{photo_size.height}, {len(photo_bytes)} байт")
+        
+        # Распознать QR-код в пуле процессов, не блокируя остальных пользователей
+        order = strategy_stats.order(branch_hint, photo_size.width, photo_size.height)
+        strategy, decoded = await decoder_pool.decode(photo_bytes, order)
+        if decoded:
+            break
+    
+    # Статистика: на каком размере фото распознаётся код (для настройки PHOTO_FIRST_MIN_SIDE)
+    photo_size_stats[max(photo_size.width, photo_size.height) if decoded else "не распознано"] += 1
+    logging.info(f"Статистика размеров фото QR: {dict(photo_size_stats)}")
+    return strategy, decoded, (photo_size.width, photo_size.height)
+
+async def decode_image_document(document, branch_hint):
+    """Распознать изображение, отправленное файлом (без пережатия Telegram)"""
+    document_file = await document.get_file()
+    image_bytes = bytes(await document_file.download_as_bytearray())
+    logging.info(f"Изображение-документ скачано: {document.mime_type}, {len(image_bytes)} байт")
+    
+    # Размер картинки-документа Telegram не сообщает — порядок без разреза по размеру
+    strategy, decoded = await decoder_pool.decode(image_bytes, strategy_stats.order(branch_hint))
+    return strategy, decoded, (None, None)
+
+async def decode_video_message(video, branch_hint):
+    """Распознать видео или видеосообщение («кружок») по кадрам"""
+    if hasattr(video, "length"):
+        size = (video.length, video.length)   # кружок квадратный
+    else:
+        size = (video.width, video.height)
+    
+    # OpenCV читает видео только из файла: клип пишется на диск потоком
+    # и читается по кадру, целиком в памяти не держится
+    fd, video_path = tempfile.mkstemp(prefix="temp_qr_", suffix=".mp4")
+    os.close(fd)
+    try:
+        video_file = await video.get_file()
+        await video_file.download_to_drive(video_path)
+        logging.info(f"Видео скачано: {size[0]}x{size[1]}, {video.duration} с, {os.path.getsize(video_path)} байт")
+        
+        order = strategy_stats.order(branch_hint, *size)
+        strategy, decoded = await decoder_pool.decode_video(video_path, order)
+    finally:
+        os.remove(video_path)
+    return strategy, decoded, size
+
+def media_rejection(message):
+    """Причина отказа для слишком большого файла или длинного видео (None — можно распознавать)"""
+    media = message.document or message.video or message.video_note
+    if media is None:
+        return None
+    if media.file_size and media.file_size > TELEGRAM_DOWNLOAD_LIMIT:
+        return "❌ Файл слишком большой. Отправьте фото QR-кода или видео покороче."
+    duration = getattr(media, "duration", None)
+    if duration and duration > QR_VIDEO_MAX_DURATION:
+        return f"❌ Видео слишком длинное. Снимите QR-код видео не длиннее {QR_VIDEO_MAX_DURATION} секунд."
+    return None
+
+# Update с текстом QR-кода для handle_qr: код прочитан из фото или сканером Mini App
+class QRTextUser:
+    def __init__(self, orig):
+        self.id = orig.id
+        self.first_name = getattr(orig, "first_name", "")
+        self.last_name = getattr(orig, "last_name", "")
+        self.username = getattr(orig, "username", "")
+
+class QRTextMessage:
+    def __init__(self, orig, text):
+        self.text = text
+        self.from_user = QRTextUser(orig.from_user)
+        self.chat = orig.chat
+        self.chat_id = orig.chat.id if hasattr(orig.chat, "id") else None
+        self.message_id = orig.message_id
+        self._orig = orig
+    
+    async def reply_text(self, text, reply_markup=None, parse_mode=None):
+        await self._orig.reply_text(text, reply_markup=reply_markup, parse_mode=parse_mode)
+
+class QRTextUpdate:
+    def __init__(self, orig, text):
+        self.message = QRTextMessage(orig.message, text)
+
+async def handle_web_app_data(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Код, прочитанный сканером Mini App (/scanner): сразу в проверку handle_qr, без фото"""
+    qr_data = update.message.web_app_data.data.strip()
+    if not qr_data.startswith(qr_payload.QR_PREFIX):
+        await update.message.reply_text(
+            "❌ QR-код не содержит ожидаемых данных.\n\n"
+            "Убедитесь, что вы сканируете QR-код с терминала учета времени."
+        )
+        return
+    logging.info(f"QR-код получен от сканера Mini App: {qr_data[:50]}...")
+    await handle_qr(QRTextUpdate(update, qr_data), context)
+
 async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Улучшенная обработка фото с QR-кодами"""
-    if not update.message.photo:
+    """Улучшенная обработка фото с QR-кодами (а также изображений-файлов, видео и кружков)"""
+    message = update.message
+    media = message.photo[-1] if message.photo else message.document or message.video or message.video_note
+    if not media:
         return
     
     user_id = update.message.from_user.id
-    photo_path = None
     
     try:
         # Проверка авторизации пользователя
@@ -952,58 +1126,42 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("Вы не авторизованы для работы с системой. Обратитесь к администратору.")
             return
         
-        # Отправить сообщение о начале обработки
-        processing_message = await update.message.reply_text("🔍 Обрабатываю фото QR-кода...")
-        
-        # Получить файл фото (берем самое большое разрешение)
-        photo_file = await update.message.photo[-1].get_file()
-        
-        # Создать уникальное имя файла для избежания конфликтов
-        import uuid
-        import tempfile
-        
-        # Использовать системную временную папку для избежания проблем с правами доступа
-        temp_dir = tempfile.gettempdir()
-        photo_filename = f"temp_qr_{uuid.uuid4().hex[:8]}.jpg"
-        photo_path = os.path.join(temp_dir, photo_filename)
-        
-        # Скачать фото
-        await photo_file.download_to_drive(photo_path)
-        logging.info(f"Фото скачано: {photo_path}, размер: {os.path.getsize(photo_path)} байт")
-        
-        # Открыть и обработать изображение
-        img = Image.open(photo_path)
-        logging.info(f"Изображение открыто: {img.size}, режим: {img.mode}")
-        
-        # Попробовать улучшить качество изображения для лучшего распознавания
-        # Конвертировать в RGB если нужно
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
+        rejection = media_rejection(message)
+        if rejection:
+            await message.reply_text(rejection)
+            return
         
-        # Попробовать декодировать QR-код
-        decoded = decode(img)
+        # Отправить сообщение о начале обработки
+        if message.video or message.video_note:
+            processing_message = await message.reply_text("🔍 Ищу QR-код в видео...")
+        else:
+            processing_message = await message.reply_text("🔍 Обрабатываю фото QR-кода...")
         
-        if not decoded:
-            # Если QR не найден, попробовать улучшить изображение
-            logging.info("QR-код не найден, пробуем улучшить изображение...")
-            
-            # Увеличить контрастность
-            from PIL import ImageEnhance
-            enhancer = ImageEnhance.Contrast(img)
-            img_enhanced = enhancer.enhance(2.0)
-            decoded = decode(img_enhanced)
-            
-            if not decoded:
-                # Попробовать увеличить яркость
-                enhancer = ImageEnhance.Brightness(img)
-                img_bright = enhancer.enhance(1.5)
-                decoded = decode(img_bright)
-                
-                if not decoded:
-                    # Попробовать изменить размер
-                    width, height = img.size
-                    img_resized = img.resize((width * 2, height * 2), Image.Resampling.LANCZOS)
-                    decoded = decode(img_resized)
+        # Повторно отправленное фото: результат распознавания уже известен
+        cache_key = media.file_unique_id
+        decoded = photo_decode_cache.get(cache_key)
+        if decoded is not None:
+            logging.info(f"Результат распознавания фото {cache_key} взят из кэша")
+        else:
+            branch_hint = await photo_branch_hint(user_id)
+            if message.photo:
+                strategy, decoded, size = await decode_photo_sizes(message.photo, branch_hint)
+            elif message.document:
+                strategy, decoded, size = await decode_image_document(message.document, branch_hint)
+            else:
+                strategy, decoded, size = await decode_video_message(media, branch_hint)
+            
+            # Кэшируется и «QR не найден»; ошибки и таймауты — нет
+            decoded = tuple(decoded)
+            photo_decode_cache.put(cache_key, decoded)
+            
+            # Статистика стратегий: учитываем филиал из самого кода, а не подсказку
+            if decoded:
+                qr_bytes = qr_payload.find(decoded)
+                branch_id = payload_branch(qr_bytes) if qr_bytes else None
+                strategy_stats.record(strategy, branch_id, *size)
+                if branch_id is not None:
+                    photo_branch_hints[user_id] = branch_id
         
         # Удалить сообщение о обработке
         try:
@@ -1023,39 +1181,14 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
         
-        # Получить данные QR-кода
-        qr_data = decoded[0].data.decode("utf-8")
-        logging.info(f"QR-код успешно декодирован: {qr_data[:50]}...")
-        
-        # Проверить, что это наш QR-код
-        if qr_data.startswith("/qr_"):
-            # Создать фейковый update для обработки QR-кода
-            class FakeUser:
-                def __init__(self, orig):
-                    self.id = orig.id
-                    self.first_name = getattr(orig, "first_name", "")
-                    self.last_name = getattr(orig, "last_name", "")
-                    self.username = getattr(orig, "username", "")
-            
-            class FakeMessage:
-                def __init__(self, orig, text):
-                    self.text = text
-                    self.from_user = FakeUser(orig.from_user)
-                    self.chat = orig.chat
-                    self.chat_id = orig.chat.id if hasattr(orig.chat, "id") else None
-                    self.message_id = orig.message_id
-                    self._orig = orig
-                
-                async def reply_text(self, text, reply_markup=None, parse_mode=None):
-                    await self._orig.reply_text(text, reply_markup=reply_markup, parse_mode=parse_mode)
-            
-            class FakeUpdate:
-                def __init__(self, orig, text):
-                    self.message = FakeMessage(orig.message, text)
-            
-            fake_update = FakeUpdate(update, qr_data)
-            await handle_qr(fake_update, context)
+        # Наш код среди прочитанных: рядом с ним в кадре может быть чужой (ссылка на киоске)
+        qr_bytes = qr_payload.find(decoded)
+        if qr_bytes:
+            qr_data = qr_bytes.decode("utf-8")
+            logging.info(f"QR-код успешно декодирован: {qr_data[:50]}...")
+            await handle_qr(QRTextUpdate(update, qr_data), context)
         else:
+            logging.info(f"На фото нет нашего QR-кода: {decoded[0][:50]!r}...")
             await update.message.reply_text(
                 "❌ QR-код не содержит ожидаемых данных.\n\n"
                 "Убедитесь, что вы сканируете QR-код с терминала учета времени."
@@ -1074,7 +1207,9 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Отправить детальное сообщение об ошибке
         error_message = "❌ Ошибка при обработке фото QR-кода.\n\n"
         
-        if "cannot identify image file" in str(e).lower():
+        if isinstance(e, asyncio.TimeoutError):
+            error_message += "Распознавание заняло слишком много времени. Попробуйте отправить фото ещё раз."
+        elif "cannot identify image file" in str(e).lower():
             error_message += "Файл не является изображением или поврежден."
         elif "no module named" in str(e).lower():
             error_message += "Ошибка системы. Сообщите администратору."
@@ -1082,22 +1217,14 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
             error_message += "Попробуйте сфотографировать QR-код еще раз с лучшим освещением."
         
         await update.message.reply_text(error_message)
-        
-    finally:
-        # Удалить временный файл
-        if photo_path and os.path.exists(photo_path):
-            try:
-                os.remove(photo_path)
-                logging.info(f"Временный файл удален: {photo_path}")
-            except Exception as e:
-                logging.warning(f"Не удалось удалить временный файл {photo_path}: {e}")
 
 if __name__ == "__main__":
     app = ApplicationBuilder().token(TELEGRAM_TOKEN).build()
     app.add_handler(CommandHandler("start", start))
     app.add_handler(MessageHandler(filters.CONTACT, contact_handler))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_qr))
-    app.add_handler(MessageHandler(filters.PHOTO, handle_photo))
+    app.add_handler(MessageHandler(QR_MEDIA_FILTER, handle_photo))
+    app.add_handler(MessageHandler(filters.StatusUpdate.WEB_APP_DATA, handle_web_app_data))
 
     async def calculate_work_hours(arrival_time, departure_time):
         """Рассчитать количество рабочих часов"""
@@ -1123,14 +1250,8 @@ if __name__ == "__main__":
     async def get_last_arrival_event(user_id):
         """Получить последнее событие прихода без соответствующего ухода"""
         try:
-            result = supabase.table("time_events").select("*").eq("telegram_id", user_id).eq("event_type", "arrival").order("event_time", desc=True).limit(1).execute()
-            if result.data and len(result.data) > 0:
-                arrival_event = result.data[0]
-                # Проверить, есть ли событие ухода после этого прихода
-                departure_result = supabase.table("time_events").select("*").eq("telegram_id", user_id).eq("event_type", "departure").gt("event_time", arrival_event["event_time"]).limit(1).execute()
-                if not departure_result.data:
-                    return arrival_event
-            return None
+            state = await shift_state.get(user_id)
+            return state["open_arrival"]
         except Exception as e:
             logging.exception("Ошибка получения последнего прихода:")
             return None
@@ -1282,8 +1403,9 @@ if __name__ == "__main__":
 
             # Сохранить событие в базу
             try:
-                res = supabase.table("time_events").insert(event_data).execute()
+                res = await db_execute(supabase.table("time_events").insert(event_data))
                 if res.data:
+                    shift_state.record(user_id, res.data[0])
                     if event_type == "arrival":
                         message = f"✅ **Приход зафиксирован!**\n\n📍 Филиал: {pending_qr['branch_name']}\n🕐 Время: {datetime.fromisoformat(pending_qr['event_time']):%d.%m.%Y %H:%M:%S} МСК\n\n✨ Хорошего рабочего дня!"
                     else:
@@ -1354,6 +1476,25 @@ if __name__ == "__main__":
                 await decline_user(query, context, user_id)
             return
 
+        # Справочник филиалов (перечитывается из базы при каждом открытии)
+        if data == "settings_branches":
+            if query.from_user.username != ADMIN_USERNAME:
+                await query.edit_message_text("У вас нет прав доступа.")
+                return
+            branch_catalog.invalidate()
+            branches = await db_call(branch_catalog.all)
+            branches_text = "\n".join(f"• {b['name']} (ID: {b['id']})" for b in branches) or "• Филиалы не найдены"
+            keyboard = InlineKeyboardMarkup([
+                [
+                    InlineKeyboardButton("🔄 Обновить", callback_data="settings_branches"),
+                    InlineKeyboardButton("🔙 Назад", callback_data="admin_settings")
+                ]
+            ])
+            await query.edit_message_text(
+                f"🏢 Филиалы\n\n{branches_text}\n\n🕐 Обновлено: {get_moscow_time().strftime('%H:%M:%S')}",
+                reply_markup=keyboard
+            )
+            return
 
         # Обработка связи с разработчиком и сообщений об ошибках
         if data == "contact_developer":
@@ -1399,10 +1540,10 @@ if __name__ == "__main__":
         if data.startswith("approve_"):
             user_id = int(data.split("_")[1])
             # Обновить статус пользователя
-            supabase.table("users").update({"status": "approved"}).eq("telegram_id", user_id).execute()
+            await db_execute(supabase.table("users").update({"status": "approved"}).eq("telegram_id", user_id))
+            user_directory.invalidate()
             # Получить chat_id пользователя
-            user_query = supabase.table("users").select("*").eq("telegram_id", user_id).execute()
-            user_data = user_query.data[0] if user_query.data and len(user_query.data) > 0 else None
+            user_data = await user_directory.get(user_id)
             if user_data and user_data.get("chat_id"):
                 await context.bot.send_message(
                     chat_id=user_data["chat_id"],
@@ -1425,9 +1566,9 @@ if __name__ == "__main__":
             await query.edit_message_text("Пользователь одобрен.")
         elif data.startswith("decline_"):
             user_id = int(data.split("_")[1])
-            supabase.table("users").update({"status": "declined"}).eq("telegram_id", user_id).execute()
-            user_query = supabase.table("users").select("*").eq("telegram_id", user_id).execute()
-            user_data = user_query.data[0] if user_query.data and len(user_query.data) > 0 else None
+            await db_execute(supabase.table("users").update({"status": "declined"}).eq("telegram_id", user_id))
+            user_directory.invalidate()
+            user_data = await user_directory.get(user_id)
             if user_data and user_data.get("chat_id"):
                 await context.bot.send_message(
                     chat_id=user_data["chat_id"],
@@ -1461,8 +1602,7 @@ if __name__ == "__main__":
     async def handle_admin_admins(query, context):
         """Управление администраторами"""
         # Получить список всех админов
-        admins_result = supabase.table("users").select("*").eq("role", "admin").execute()
-        admins_count = len(admins_result.data) if admins_result.data else 0
+        admins_count = len(await user_directory.with_roles("admin"))
         
         keyboard = InlineKeyboardMarkup([
             [
@@ -1488,13 +1628,13 @@ if __name__ == "__main__":
         """Статистика системы"""
         try:
             # Получить статистику
-            users_result = supabase.table("users").select("*").execute()
-            events_result = supabase.table("time_events").select("*").gte("event_time", get_moscow_time().replace(hour=0, minute=0, second=0).isoformat()).execute()
+            users = await user_directory.all()
+            events_result = await db_execute(supabase.table("time_events").select("*").gte("event_time", get_moscow_time().replace(hour=0, minute=0, second=0).isoformat()))
             
-            total_users = len(users_result.data) if users_result.data else 0
-            pending_users = len([u for u in users_result.data if u.get("status") == "pending"]) if users_result.data else 0
-            approved_users = len([u for u in users_result.data if u.get("status") == "approved"]) if users_result.data else 0
-            admins = len([u for u in users_result.data if u.get("role") in ["admin", "superuser"]]) if users_result.data else 0
+            total_users = len(users) if users else 0
+            pending_users = len([u for u in users if u.get("status") == "pending"]) if users else 0
+            approved_users = len([u for u in users if u.get("status") == "approved"]) if users else 0
+            admins = len([u for u in users if u.get("role") in ["admin", "superuser"]]) if users else 0
             
             # События сегодня
             today_events = len(events_result.data) if events_result.data else 0
@@ -1566,8 +1706,8 @@ if __name__ == "__main__":
             offset = (page - 1) * per_page
             
             # Получить пользователей с пагинацией
-            users_result = supabase.table("users").select("*").order("created_at", desc=True).range(offset, offset + per_page - 1).execute()
-            total_result = supabase.table("users").select("id", count="exact").execute()
+            users_result = await db_execute(supabase.table("users").select("*").order("created_at", desc=True).range(offset, offset + per_page - 1))
+            total_result = await db_execute(supabase.table("users").select("id", count="exact"))
             
             if not users_result.data:
                 await query.edit_message_text("Пользователи не найдены.")
@@ -1636,10 +1776,11 @@ if __name__ == "__main__":
         """Повысить пользователя до админа"""
         try:
             # Обновить роль пользователя
-            result = supabase.table("users").update({
+            result = await db_execute(supabase.table("users").update({
                 "role": "admin",
                 "can_approve_registrations": True
-            }).eq("telegram_id", user_id).execute()
+            }).eq("telegram_id", user_id))
+            user_directory.invalidate()
             
             if result.data:
                 # Получить данные пользователя для уведомления
@@ -1665,16 +1806,17 @@ if __name__ == "__main__":
         """Понизить админа до обычного пользователя"""
         try:
             # Проверить, что это не суперпользователь
-            user_result = supabase.table("users").select("*").eq("telegram_id", user_id).execute()
-            if user_result.data and user_result.data[0].get("role") == "superuser":
+            user_data = await user_directory.get(user_id)
+            if user_data and user_data.get("role") == "superuser":
                 await query.edit_message_text("❌ Нельзя снять права у суперпользователя.")
                 return
             
             # Обновить роль пользователя
-            result = supabase.table("users").update({
+            result = await db_execute(supabase.table("users").update({
                 "role": "user",
                 "can_approve_registrations": False
-            }).eq("telegram_id", user_id).execute()
+            }).eq("telegram_id", user_id))
+            user_directory.invalidate()
             
             if result.data:
                 user_data = result.data[0]
@@ -1699,12 +1841,11 @@ if __name__ == "__main__":
         """Удалить пользователя"""
         try:
             # Проверить, что это не суперпользователь
-            user_result = supabase.table("users").select("*").eq("telegram_id", user_id).execute()
-            if user_result.data and user_result.data[0].get("role") == "superuser":
+            user_data = await user_directory.get(user_id)
+            if user_data and user_data.get("role") == "superuser":
                 await query.edit_message_text("❌ Нельзя удалить суперпользователя.")
                 return
             
-            user_data = user_result.data[0] if user_result.data else None
             if not user_data:
                 await query.edit_message_text("❌ Пользователь не найден.")
                 return
@@ -1712,10 +1853,12 @@ if __name__ == "__main__":
             user_name = f"{user_data.get('first_name', '')} {user_data.get('last_name', '')}".strip()
             
             # Удалить все события пользователя
-            supabase.table("time_events").delete().eq("telegram_id", user_id).execute()
+            await db_execute(supabase.table("time_events").delete().eq("telegram_id", user_id))
+            shift_state.invalidate(user_id)
             
             # Удалить пользователя
-            result = supabase.table("users").delete().eq("telegram_id", user_id).execute()
+            result = await db_execute(supabase.table("users").delete().eq("telegram_id", user_id))
+            user_directory.invalidate()
             
             if result.data:
                 await query.edit_message_text(f"✅ Пользователь {user_name} удален из системы.")
@@ -1729,7 +1872,8 @@ if __name__ == "__main__":
     async def approve_user(query, context, user_id):
         """Одобрить пользователя"""
         try:
-            result = supabase.table("users").update({"status": "approved"}).eq("telegram_id", user_id).execute()
+            result = await db_execute(supabase.table("users").update({"status": "approved"}).eq("telegram_id", user_id))
+            user_directory.invalidate()
             
             if result.data:
                 user_data = result.data[0]
@@ -1753,7 +1897,8 @@ if __name__ == "__main__":
     async def decline_user(query, context, user_id):
         """Отклонить пользователя"""
         try:
-            result = supabase.table("users").update({"status": "declined"}).eq("telegram_id", user_id).execute()
+            result = await db_execute(supabase.table("users").update({"status": "declined"}).eq("telegram_id", user_id))
+            user_directory.invalidate()
             
             if result.data:
                 user_data = result.data[0]
@@ -1781,14 +1926,13 @@ if __name__ == "__main__":
             today_start = moscow_now.replace(hour=0, minute=0, second=0, microsecond=0)
             
             # Получить всех пользователей, которые пришли сегодня
-            arrivals_today = supabase.table("time_events").select("*").eq("event_type", "arrival").gte("event_time", today_start.isoformat()).execute()
+            arrivals_today = await db_execute(supabase.table("time_events").select("*").eq("event_type", "arrival").gte("event_time", today_start.isoformat()))
             
             # Получить всех пользователей, которые ушли сегодня
-            departures_today = supabase.table("time_events").select("*").eq("event_type", "departure").gte("event_time", today_start.isoformat()).execute()
+            departures_today = await db_execute(supabase.table("time_events").select("*").eq("event_type", "departure").gte("event_time", today_start.isoformat()))
             
             # Получить филиалы
-            branches_result = supabase.table("branches").select("*").execute()
-            branches = {b["id"]: b["name"] for b in branches_result.data} if branches_result.data else {}
+            branches = await catalog_call(branch_catalog.names)
             
             # Анализ кто сейчас на работе
             currently_at_work = []
@@ -1912,7 +2056,7 @@ if __name__ == "__main__":
     async def get_or_create_tamagotchi(user_id):
         """Получить или создать тамагочи для пользователя"""
         try:
-            result = supabase.table("tamagotchi").select("*").eq("telegram_id", user_id).execute()
+            result = await db_execute(supabase.table("tamagotchi").select("*").eq("telegram_id", user_id))
             if result.data:
                 return result.data[0]
             else:
@@ -1928,7 +2072,7 @@ if __name__ == "__main__":
                     "is_alive": True,
                     "last_fed": get_moscow_time().isoformat()
                 }
-                create_result = supabase.table("tamagotchi").insert(new_tamagotchi).execute()
+                create_result = await db_execute(supabase.table("tamagotchi").insert(new_tamagotchi))
                 return create_result.data[0] if create_result.data else new_tamagotchi
         except Exception as e:
             logging.exception("Ошибка получения тамагочи:")
@@ -1966,7 +2110,7 @@ if __name__ == "__main__":
                 "updated_at": now.isoformat()
             }
             
-            supabase.table("tamagotchi").update(updated_data).eq("telegram_id", user_id).execute()
+            await db_execute(supabase.table("tamagotchi").update(updated_data).eq("telegram_id", user_id))
             
             # Вернуть обновленные данные
             tamagotchi.update(updated_data)
@@ -2010,7 +2154,7 @@ if __name__ == "__main__":
                 "updated_at": get_moscow_time().isoformat()
             }
             
-            supabase.table("tamagotchi").update(updated_data).eq("telegram_id", user_id).execute()
+            await db_execute(supabase.table("tamagotchi").update(updated_data).eq("telegram_id", user_id))
             
             # Обновить локальные данные
             tamagotchi.update(updated_data)
@@ -2030,7 +2174,7 @@ if __name__ == "__main__":
     async def get_tamagotchi_message(message_type):
         """Получить случайное сообщение тамагочи"""
         try:
-            result = supabase.table("tamagotchi_messages").select("*").eq("message_type", message_type).execute()
+            result = await db_execute(supabase.table("tamagotchi_messages").select("*").eq("message_type", message_type))
             if result.data:
                 import random
                 message_data = random.choice(result.data)
@@ -2087,7 +2231,7 @@ if __name__ == "__main__":
                 "updated_at": get_moscow_time().isoformat()
             }
             
-            supabase.table("tamagotchi").update(updated_data).eq("telegram_id", user_id).execute()
+            await db_execute(supabase.table("tamagotchi").update(updated_data).eq("telegram_id", user_id))
             message = await get_tamagotchi_message("revive")
             return message
             
@@ -2207,12 +2351,12 @@ if __name__ == "__main__":
                 "status": "new"
             }
             
-            supabase.table("feedback_messages").insert(message_data).execute()
+            await db_execute(supabase.table("feedback_messages").insert(message_data))
             
             # Отправить уведомление админу и суперадмину
-            admin_query = supabase.table("users").select("*").in_("role", ["admin", "superuser"]).execute()
+            admins = await user_directory.with_roles("admin", "superuser")
             
-            for admin in admin_query.data if admin_query.data else []:
+            for admin in admins:
                 if admin.get("chat_id"):
                     try:
                         await context.bot.send_message(
@@ -2265,12 +2409,12 @@ if __name__ == "__main__":
                 "priority": "medium"
             }
             
-            supabase.table("feedback_messages").insert(bug_data).execute()
+            await db_execute(supabase.table("feedback_messages").insert(bug_data))
             
             # Отправить уведомление админу и суперадмину
-            admin_query = supabase.table("users").select("*").in_("role", ["admin", "superuser"]).execute()
+            admins = await user_directory.with_roles("admin", "superuser")
             
-            for admin in admin_query.data if admin_query.data else []:
+            for admin in admins:
                 if admin.get("chat_id"):
                     try:
                         await context.bot.send_message(
@@ -2306,9 +2450,13 @@ if __name__ == "__main__":
 
     app.add_handler(MessageHandler(filters.CONTACT, contact_handler))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_qr))
-    app.add_handler(MessageHandler(filters.PHOTO, handle_photo))
+    app.add_handler(MessageHandler(QR_MEDIA_FILTER, handle_photo))
+    app.add_handler(MessageHandler(filters.StatusUpdate.WEB_APP_DATA, handle_web_app_data))
     app.add_handler(CommandHandler("start", start))
     from telegram.ext import CallbackQueryHandler
     app.add_handler(CallbackQueryHandler(callback_handler))
 
+    # Процессы распознавания QR запускаются до цикла событий, первое фото их не ждёт
+    decoder_pool.start()
     app.run_polling()
+    strategy_stats.save()
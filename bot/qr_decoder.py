@@ -0,0 +1,476 @@
+# bot/qr_decoder.py
+"""Распознавание QR-кодов с фото в пуле процессов.
+
+Декодирование (Pillow + pyzbar) занимает процессор на сотни миллисекунд.
+В цикле событий бота оно останавливало бы обработку всех остальных
+апдейтов, поэтому выполняется в отдельных процессах, а обработчик
+ждёт результат через await с ограничением по времени.
+
+Сначала OpenCV находит углы кода, и pyzbar читает только выровненную
+область с кодом; весь кадр и его бинаризованные варианты
+(bot/qr_preprocess.py) — запасной путь. Варианты оформлены как
+стратегии: при одном процессе они идут по очереди в одной задаче,
+при нескольких — наперегонки, и первый прочитанный /qr_ код
+отменяет ещё не начатые.
+
+Видео (и кружки) читаются из файла по кадру, с адаптивным шагом.
+"""
+
+import asyncio
+import io
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+import numpy as np
+from PIL import Image
+from pyzbar.pyzbar import decode
+
+from bot.qr_preprocess import Preprocessor
+from utils import qr_payload
+
+# Число процессов распознавания (под квоту CPU контейнера и память).
+# Каждый процесс занимает около 90 МБ (PSS): OpenCV, NumPy и pyzbar плюс
+# заново импортированный bot/bot.py (см. _MP_CONTEXT); сам бот — ещё около
+# 80 МБ. При лимите контейнера 256 МБ (docker-compose.yml) помещается один
+# процесс; для двух и больше лимит нужно поднять
+QR_DECODE_WORKERS = int(os.environ.get("QR_DECODE_WORKERS", "1"))
+# Максимальное время распознавания одного фото, секунд
+QR_DECODE_TIMEOUT = float(os.environ.get("QR_DECODE_TIMEOUT", "15"))
+# Предел размера изображения в пикселях: крупные фото уменьшаются до него,
+# этого с запасом хватает для QR, занимающего заметную часть кадра
+QR_MAX_PIXELS = int(os.environ.get("QR_MAX_PIXELS", "4000000"))
+# Лестница разрешений: сначала дешёвая попытка, полное — только если она не удалась
+QR_DECODE_LADDER = (1000000, QR_MAX_PIXELS)
+# Больше этого исходные изображения не открываются вовсе (защита от
+# «бомб» в PNG и других форматах, которые нельзя декодировать с уменьшением)
+QR_MAX_SOURCE_PIXELS = 40000000
+# Поиск углов кода идёт по уменьшенной копии кадра
+QR_DETECT_PIXELS = 1000000
+# Сторона выровненной области с кодом: не меньше и не больше, пикселей
+ROI_MIN_SIDE = 400
+ROI_MAX_SIDE = 1000
+# Поле вокруг кода в выровненной области (доля стороны кода)
+ROI_MARGIN = 0.15
+# Видео: не больше стольких кадров на распознавание и общее время на клип, секунд
+QR_VIDEO_MAX_FRAMES = int(os.environ.get("QR_VIDEO_MAX_FRAMES", "24"))
+QR_VIDEO_TIMEOUT = float(os.environ.get("QR_VIDEO_TIMEOUT", "30"))
+# Шаг между кадрами-пробами (секунд клипа), если число кадров неизвестно
+QR_VIDEO_STEP = 0.5
+# Для кадра видео — только первые стратегии порядка: кадров много, лучше взять другой
+QR_VIDEO_STRATEGIES = 3
+# Кадр резкостью ниже этой доли от лучшей в клипе не распознаётся, берётся следующий
+QR_VIDEO_BLUR_RATIO = 0.5
+
+# Процессы пула порождает forkserver, а не fork бота: после запуска у бота
+# есть потоки (пул базы, фоновые обновления кэшей), и пул, пересозданный
+# после таймаута, не должен наследовать их блокировки. Сервер один раз
+# импортирует этот модуль, рабочие процессы получают его готовым. Главный
+# модуль (bot/bot.py) каждый рабочий процесс, в том числе после
+# перезапуска пула, всё равно импортирует заново как __mp_main__: так
+# multiprocessing готовит процессы forkserver. Выполняется код уровня
+# модуля (клиент Supabase, кэши), но не запуск бота под __main__
+_MP_CONTEXT = multiprocessing.get_context("forkserver")
+_MP_CONTEXT.set_forkserver_preload([__name__])
+
+_detector = cv2.QRCodeDetector()
+# Буферы предобработки живут в процессе пула между фото
+_preprocessor = Preprocessor()
+
+
+def fit_pixels(size, max_pixels):
+    """Размер, уменьшенный с сохранением пропорций до max_pixels"""
+    width, height = size
+    if width * height <= max_pixels:
+        return size
+    scale = (max_pixels / (width * height)) ** 0.5
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def locate_qr(gray):
+    """Углы QR-кода на изображении (numpy, оттенки серого) или None.
+
+    Детектор работает на копии не больше QR_DETECT_PIXELS, углы
+    пересчитываются в координаты исходного изображения.
+    """
+    height, width = gray.shape
+    small_size = fit_pixels((width, height), QR_DETECT_PIXELS)
+    small = gray if small_size == (width, height) else cv2.resize(gray, small_size, interpolation=cv2.INTER_AREA)
+    found, points = _detector.detect(small)
+    if not found or points is None:
+        return None
+    corners = points.reshape(4, 2).astype(np.float32)
+    corners[:, 0] *= width / small_size[0]
+    corners[:, 1] *= height / small_size[1]
+    return corners
+
+
+def warp_qr(gray, corners):
+    """Вырезать код по углам и выровнять перспективу (квадрат с полем)"""
+    side = max(np.linalg.norm(corners[i] - corners[(i + 1) % 4]) for i in range(4))
+    side = int(min(max(side, ROI_MIN_SIDE), ROI_MAX_SIDE))
+    margin = int(side * ROI_MARGIN)
+    size = side + margin * 2
+    target = np.array(
+        [[margin, margin], [margin + side, margin], [margin + side, margin + side], [margin, margin + side]],
+        dtype=np.float32,
+    )
+    matrix = cv2.getPerspectiveTransform(corners, target)
+    return cv2.warpPerspective(gray, matrix, (size, size), flags=cv2.INTER_LINEAR, borderValue=255)
+
+
+def load_gray(data, max_pixels):
+    """Открыть изображение в оттенках серого не больше max_pixels.
+
+    JPEG через draft() декодируется сразу в уменьшенном масштабе (1/2,
+    1/4, 1/8) и только по яркости, так что полноразмерный кадр в память
+    не попадает; остаток уменьшается до бюджета обычным resize.
+    """
+    img = Image.open(io.BytesIO(data))
+    width, height = img.size
+    if width * height > QR_MAX_SOURCE_PIXELS:
+        raise ValueError(f"слишком большое изображение: {width}x{height}")
+    target = fit_pixels(img.size, max_pixels)
+    if img.format == "JPEG":
+        img.draft("L", target)
+    if img.mode != 'L':
+        img = img.convert('L')
+    if img.size[0] * img.size[1] > max_pixels:
+        img = img.resize(fit_pixels(img.size, max_pixels), Image.Resampling.BILINEAR)
+    return img
+
+
+class _Photo:
+    """Один уровень лестницы разрешений: изображение и лениво найденная область кода"""
+
+    def __init__(self, img):
+        self.img = img
+        self.gray = np.asarray(img)
+        self._roi = None
+        self._located = False
+
+    @property
+    def roi(self):
+        if not self._located:
+            self._located = True
+            corners = locate_qr(self.gray)
+            if corners is not None:
+                self._roi = warp_qr(self.gray, corners)
+        return self._roi
+
+    def sources(self):
+        """Сначала выровненная область кода (если найдена), потом весь кадр"""
+        return [self.gray] if self.roi is None else [self.roi, self.gray]
+
+
+def _strategy_roi(photo):
+    return decode(photo.roi) if photo.roi is not None else []
+
+
+def _strategy_frame(photo):
+    return decode(photo.gray)
+
+
+def _preprocessed(method):
+    def strategy(photo):
+        for source in photo.sources():
+            decoded = decode(getattr(_preprocessor, method)(source))
+            if decoded:
+                return decoded
+        return []
+    return strategy
+
+
+def _strategy_downscale(photo):
+    # Крупный шумный код читается лучше после усреднения пикселей
+    width, height = photo.img.size
+    return decode(photo.img.resize((width // 2, height // 2), Image.Resampling.BOX))
+
+
+def _strategy_upscale(photo):
+    # Мелкий код, который OpenCV не нашёл: увеличение кадра в пределах бюджета пикселей
+    width, height = photo.img.size
+    target = fit_pixels((width * 2, height * 2), QR_MAX_PIXELS)
+    if target[0] <= width:
+        return []
+    return decode(photo.img.resize(target, Image.Resampling.LANCZOS))
+
+
+# Стратегии распознавания по порядку: от дешёвых и частых к дорогим
+STRATEGIES = {
+    "roi": _strategy_roi,
+    "frame": _strategy_frame,
+    "glare": _preprocessed("suppress_glare"),
+    "adaptive": _preprocessed("adaptive_threshold"),
+    "unsharp": _preprocessed("unsharp"),
+    "downscale": _strategy_downscale,
+    "upscale": _strategy_upscale,
+}
+# Порядок по умолчанию; обработчик может передать свой (bot/strategy_stats.py)
+STRATEGY_ORDER = tuple(STRATEGIES)
+# Увеличение кадра имеет смысл только на последнем уровне лестницы
+LAST_LEVEL_ONLY = {"upscale"}
+
+
+def is_qr_payload(decoded):
+    """Есть ли среди прочитанных кодов наш (/qr_...)"""
+    return qr_payload.find(decoded) is not None
+
+
+def ladder(data):
+    """Уровни лестницы разрешений для фото: [(бюджет пикселей, последний ли)]"""
+    width, height = Image.open(io.BytesIO(data)).size   # только заголовок
+    levels = []
+    for step, max_pixels in enumerate(QR_DECODE_LADDER):
+        # Фото целиком укладывается в бюджет — большее разрешение ничего не даст
+        last = step == len(QR_DECODE_LADDER) - 1 or width * height <= max_pixels
+        levels.append((max_pixels, last))
+        if last:
+            break
+    return levels
+
+
+def level_strategies(last, order=STRATEGY_ORDER):
+    return [name for name in order if last or name not in LAST_LEVEL_ONLY]
+
+
+# Последнее загруженное фото в процессе пула: стратегии одного фото,
+# попавшие в один процесс, не декодируют JPEG заново
+_loaded = {"key": None, "photo": None}
+
+
+def _load_photo(data, max_pixels):
+    key = (len(data), hash(data), max_pixels)
+    if _loaded["key"] != key:
+        _loaded["photo"] = None   # освободить прошлое фото до загрузки нового
+        _loaded["photo"] = _Photo(load_gray(data, max_pixels))
+        _loaded["key"] = key
+    return _loaded["photo"]
+
+
+def run_strategy(data, max_pixels, name):
+    """Одна стратегия на одном уровне (задача пула при гонке); → (имя, данные кодов)"""
+    decoded = STRATEGIES[name](_load_photo(data, max_pixels))
+    return name, [d.data for d in decoded]
+
+
+def decode_photo(data, order=STRATEGY_ORDER):
+    """Найти QR-коды на фото, стратегии по очереди (одна задача пула).
+
+    data — байты файла изображения, order — порядок стратегий.
+    Возвращает (стратегия, список данных найденных кодов (bytes));
+    если код не найден — (None, []). Фото распознаётся по лестнице
+    QR_DECODE_LADDER: следующее разрешение — только при неудаче.
+    Чужой QR (например, ссылка на рамке киоска) поиск не останавливает
+    и возвращается, только если /qr_ код так и не найден.
+    """
+    other_code = (None, [])
+    for max_pixels, last in ladder(data):
+        photo = _Photo(load_gray(data, max_pixels))
+        logging.info(f"Распознавание QR: {photo.img.size}, бюджет {max_pixels} пикс.")
+        for tried, name in enumerate(level_strategies(last, order), 1):
+            decoded = [d.data for d in STRATEGIES[name](photo)]
+            if is_qr_payload(decoded):
+                logging.info(f"QR-код прочитан стратегией {name} (попытка {tried})")
+                return name, decoded
+            if decoded and not other_code[1]:
+                other_code = (name, decoded)
+        if not last:
+            logging.info("QR-код не найден, пробуем большее разрешение...")
+    return other_code
+
+
+def frame_gray(frame, max_pixels=QR_DECODE_LADDER[0]):
+    """Кадр OpenCV (BGR) → оттенки серого в пределах бюджета пикселей"""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    height, width = gray.shape
+    target = fit_pixels((width, height), max_pixels)
+    if target != (width, height):
+        gray = cv2.resize(gray, target, interpolation=cv2.INTER_AREA)
+    return gray
+
+
+def sharpness(gray):
+    """Резкость кадра: дисперсия лапласиана"""
+    return cv2.Laplacian(gray, cv2.CV_32F).var()
+
+
+def decode_video(path, order=STRATEGY_ORDER, max_frames=QR_VIDEO_MAX_FRAMES):
+    """Найти QR-код в видео (путь к файлу; задача пула) → (стратегия, данные кодов).
+
+    Клип читается потоком: grab() пропускает кадр без копирования,
+    retrieve() — только для проб, в памяти всегда один кадр. Шаг
+    раскладывает max_frames проб по всему клипу и подстраивается под
+    съёмку: смазанная проба (резкость ниже QR_VIDEO_BLUR_RATIO от лучшей)
+    не тратит попытку, вместо неё сразу берётся следующий кадр. Первый
+    прочитанный /qr_ код завершает поиск, чужой — возвращается, только
+    если нашего не нашлось.
+    """
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise ValueError("не удалось открыть видео")
+    try:
+        total = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        fps = capture.get(cv2.CAP_PROP_FPS) or 30
+        if total > 0:
+            stride = max(1, total // max_frames)
+        else:
+            stride = max(1, round(fps * QR_VIDEO_STEP))
+        names = level_strategies(False, order)[:QR_VIDEO_STRATEGIES]
+        logging.info(f"Распознавание QR в видео: {total} кадров, {fps:.0f} к/с, шаг {stride}")
+
+        index = tried = next_sample = 0
+        best_sharpness = 0.0
+        other_code = (None, [])
+        while tried < max_frames and capture.grab():
+            if index >= next_sample:
+                next_sample = index + stride
+                ok, frame = capture.retrieve()
+                gray = frame_gray(frame) if ok else None
+                if gray is not None:
+                    frame_sharpness = sharpness(gray)
+                    if frame_sharpness < best_sharpness * QR_VIDEO_BLUR_RATIO:
+                        next_sample = index + 1
+                    else:
+                        best_sharpness = max(best_sharpness, frame_sharpness)
+                        tried += 1
+                        photo = _Photo(Image.fromarray(gray))
+                        for name in names:
+                            decoded = [d.data for d in STRATEGIES[name](photo)]
+                            if is_qr_payload(decoded):
+                                logging.info(f"QR-код прочитан в кадре {index} стратегией {name} (проба {tried})")
+                                return name, decoded
+                            if decoded and not other_code[1]:
+                                other_code = (name, decoded)
+            index += 1
+        return other_code
+    finally:
+        capture.release()
+
+
+def _warm_up():
+    return os.getpid()
+
+
+def _consume_result(future):
+    # Результаты проигравших стратегий никто не ждёт — не даём asyncio ругаться на их ошибки
+    if not future.cancelled():
+        future.exception()
+
+
+class QRDecoderPool:
+    """Пул процессов распознавания с таймаутом на фото.
+
+    start() вызывается при запуске бота и дожидается всех процессов, дальше
+    они переиспользуются. Если фото не уложилось в таймаут, зависший пул
+    убивается, а новый создаётся при следующем фото без ожидания в цикле
+    событий: процессы запускаются в фоне, задача ждёт их через await.
+
+    При одном процессе фото распознаётся одной задачей (decode_photo).
+    При нескольких стратегии каждого уровня запускаются параллельно, и
+    побеждает первая, прочитавшая /qr_ код.
+    """
+
+    def __init__(self, workers=QR_DECODE_WORKERS, timeout=QR_DECODE_TIMEOUT):
+        self.workers = workers
+        self.timeout = timeout
+        self._executor = None
+
+    def start(self, wait=True):
+        """Создать пул; wait=True — дождаться запуска всех процессов (при старте бота)"""
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=_MP_CONTEXT)
+            # Процессы порождаются по мере задач: прогрев сразу запускает все
+            warm_up = [self._executor.submit(_warm_up) for _ in range(self.workers)]
+            if wait:
+                for future in warm_up:
+                    future.result()
+            logging.info(f"Пул распознавания QR запущен: {self.workers} процесс(ов)")
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def decode(self, data, order=STRATEGY_ORDER):
+        """Распознать фото (байты файла) в пуле → (стратегия, данные кодов).
+
+        order — порядок стратегий; при гонке первые в нём раньше
+        занимают процессы. asyncio.TimeoutError, если не уложились в таймаут.
+        """
+        executor = self.start(wait=False)
+        if self.workers > 1:
+            job = self._race_ladder(executor, data, tuple(order))
+        else:
+            job = asyncio.wrap_future(executor.submit(decode_photo, data, tuple(order)))
+        return await self._wait(executor, job, self.timeout)
+
+    async def decode_video(self, path, order=STRATEGY_ORDER, timeout=QR_VIDEO_TIMEOUT):
+        """Распознать видео (путь к файлу) в пуле → (стратегия, данные кодов)"""
+        executor = self.start(wait=False)
+        job = asyncio.wrap_future(executor.submit(decode_video, path, tuple(order)))
+        return await self._wait(executor, job, timeout)
+
+    async def _wait(self, executor, job, timeout):
+        try:
+            return await asyncio.wait_for(job, timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Распознавание QR не уложилось в {timeout} с, перезапускаем пул")
+            self._restart(executor)
+            raise
+        except BrokenProcessPool:
+            logging.error("Процесс распознавания QR аварийно завершился, перезапускаем пул")
+            self._restart(executor)
+            raise
+
+    async def _race_ladder(self, executor, data, order):
+        # Чужой QR не останавливает лестницу: наш код может прочитаться на следующем уровне
+        other_code = (None, [])
+        for max_pixels, last in ladder(data):
+            name, decoded = await self._race(executor, data, max_pixels, level_strategies(last, order))
+            if is_qr_payload(decoded):
+                return name, decoded
+            if decoded and not other_code[1]:
+                other_code = (name, decoded)
+        return other_code
+
+    async def _race(self, executor, data, max_pixels, names):
+        """Стратегии уровня наперегонки: первый /qr_ код отменяет остальные.
+
+        Уже выполняющиеся задачи доработают в фоне (процесс пула нельзя
+        прервать без перезапуска), но ещё не начатые снимаются с очереди.
+        """
+        futures = [executor.submit(run_strategy, data, max_pixels, name) for name in names]
+        waiters = [asyncio.wrap_future(f) for f in futures]
+        for waiter in waiters:
+            waiter.add_done_callback(_consume_result)
+        other_code = (None, [])
+        try:
+            for next_done in asyncio.as_completed(waiters):
+                name, decoded = await next_done
+                if is_qr_payload(decoded):
+                    logging.info(f"QR-код прочитан стратегией {name} (бюджет {max_pixels} пикс.)")
+                    return name, decoded
+                # Чужой QR вернём, только если наш так и не найдётся
+                if decoded and not other_code[1]:
+                    other_code = (name, decoded)
+            return other_code
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def _restart(self, executor):
+        # Пул мог уже пересоздать другой обработчик
+        if self._executor is not executor:
+            return
+        self._executor = None
+        for process in list(getattr(executor, "_processes", {}).values()):
+            process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+decoder_pool = QRDecoderPool()
@@ -0,0 +1,93 @@
+# bot/qr_preprocess.py
+"""Предобработка трудных фото QR-кода (оттенки серого, NumPy/OpenCV).
+
+Типичный сбой — экран киоска, снятый под лампами клиники: блик на
+части кода, неравномерная яркость, лёгкая размытость. Для таких фото
+строятся бинаризованные варианты изображения — каждый используется
+своей стратегией распознавания (bot/qr_decoder.py, STRATEGIES):
+
+1. glare — выравнивание освещения (подавление бликов) + порог Оцу;
+2. adaptive — адаптивный (локальный) порог;
+3. unsharp — выравнивание освещения + нерезкое маскирование + порог Оцу.
+
+Все операции пишут в заранее выделенные буферы, поэтому попытки не
+создают новых массивов размером с кадр.
+"""
+
+import cv2
+import numpy as np
+
+
+# Буферы держатся для стольких размеров: стратегии чередуют выровненную
+# область кода и весь кадр, на двух уровнях лестницы разрешений
+BUFFER_SHAPES = 4
+
+
+def _odd(value, minimum=3):
+    value = max(int(value), minimum)
+    return value if value % 2 else value + 1
+
+
+class Preprocessor:
+    """Построение бинаризованных вариантов изображения с переиспользованием буферов.
+
+    Буферы выделяются под размер изображения и хранятся для последних
+    BUFFER_SHAPES размеров. Методы возвращают буфер своего размера:
+    результат нужно распознать до следующего вызова с тем же размером.
+    """
+
+    def __init__(self):
+        self._buffers = {}   # размер → (фон, рабочий, результат)
+        self._background = None
+        self._work = None
+        self._out = None
+
+    def _ensure(self, shape):
+        buffers = self._buffers.pop(shape, None)
+        if buffers is None:
+            buffers = tuple(np.empty(shape, dtype=np.uint8) for _ in range(3))
+            if len(self._buffers) >= BUFFER_SHAPES:
+                self._buffers.pop(next(iter(self._buffers)))
+        # Последний использованный размер — в конце, вытесняется самый давний
+        self._buffers[shape] = buffers
+        self._background, self._work, self._out = buffers
+
+    def _flatten(self, gray):
+        """Деление на локальный уровень белого (в self._work): выравнивает освещение и гасит блики.
+
+        Уровень белого — морфологическое закрытие окном шире трёх модулей
+        кода: тёмные модули (включая центр поискового узора) исчезают,
+        остаётся фон с бликом.
+        """
+        size = _odd(min(gray.shape) / 6)
+        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (size, size))
+        cv2.morphologyEx(gray, cv2.MORPH_CLOSE, kernel, dst=self._background)
+        np.maximum(self._background, 1, out=self._background)
+        cv2.divide(gray, self._background, dst=self._work, scale=255)
+        return self._work
+
+    def suppress_glare(self, gray):
+        """Выравнивание освещения, затем порог Оцу"""
+        self._ensure(gray.shape)
+        flat = self._flatten(gray)
+        cv2.threshold(flat, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU, dst=self._out)
+        return self._out
+
+    def adaptive_threshold(self, gray):
+        """Порог по среднему окрестности (окно ~1/6 стороны, шире центра поискового узора)"""
+        self._ensure(gray.shape)
+        block = _odd(min(gray.shape) / 6, minimum=11)
+        cv2.adaptiveThreshold(
+            gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, block, 5, dst=self._out
+        )
+        return self._out
+
+    def unsharp(self, gray, amount=1.5):
+        """Нерезкое маскирование против размытия (по выровненному изображению), затем порог Оцу"""
+        self._ensure(gray.shape)
+        flat = self._flatten(gray)
+        sigma = max(1.0, min(gray.shape) / 300)
+        cv2.GaussianBlur(flat, (0, 0), sigma, dst=self._background)
+        cv2.addWeighted(flat, 1 + amount, self._background, -amount, 0, dst=self._work)
+        cv2.threshold(self._work, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU, dst=self._out)
+        return self._out
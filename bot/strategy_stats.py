@@ -0,0 +1,132 @@
+# bot/strategy_stats.py
+"""Статистика стратегий распознавания QR и порядок их перебора.
+
+Для каждого распознанного фото запоминается стратегия, которая
+прочитала код (bot/qr_decoder.py, STRATEGIES), в трёх разрезах:
+общий, по филиалу из данных кода и по размеру фото. Стратегии,
+которые чаще срабатывают у киоска филиала (его освещение, экран,
+типичный ракурс), перебираются первыми — в среднем до успеха
+доходит меньше вызовов pyzbar.
+
+Таблица — счётчики побед вида {"*": {"roi": 120, ...}, "b3": {...},
+"s1280": {...}}; она периодически сохраняется в JSON и переживает
+перезапуск бота.
+"""
+
+import json
+import logging
+import os
+import time
+from collections import Counter
+
+# Файл состояния — вне каталога с кодом (в docker-compose это том bot_data)
+QR_STRATEGY_STATS_PATH = os.environ.get(
+    "QR_STRATEGY_STATS_PATH", os.path.expanduser("~/.local/state/qr-bot/qr_strategy_stats.json")
+)
+# Не чаще одной записи файла за столько секунд
+QR_STRATEGY_STATS_FLUSH = int(os.environ.get("QR_STRATEGY_STATS_FLUSH", "300"))
+# Когда в разрезе набирается столько побед, счётчики делятся пополам:
+# старые фото весят меньше, порядок следует за сменой освещения и экрана
+STATS_HALF_LIFE = 200
+# Вес общей статистики (или статистики размера) против статистики филиала
+PRIOR_WEIGHT = 5
+# Границы длинной стороны фото для разреза по размеру
+SIZE_BUCKETS = (800, 1280, 2560)
+
+GLOBAL_SCOPE = "*"
+
+
+def size_scope(width, height):
+    """Разрез по размеру: "s<граница>" для длинной стороны фото"""
+    side = max(width, height)
+    bucket = next((limit for limit in SIZE_BUCKETS if side <= limit), "max")
+    return f"s{bucket}"
+
+
+def branch_scope(branch_id):
+    return f"b{branch_id}"
+
+
+class StrategyStats:
+    """Счётчики побед стратегий и порядок перебора на их основе.
+
+    default_order — порядок без статистики и при равенстве счётчиков.
+    """
+
+    def __init__(self, default_order, path=QR_STRATEGY_STATS_PATH, flush_interval=QR_STRATEGY_STATS_FLUSH):
+        self.default_order = tuple(default_order)
+        self.path = path
+        self.flush_interval = flush_interval
+        self._wins = {}   # разрез → Counter(стратегия → побед)
+        self._dirty = False
+        self._saved_at = time.monotonic()
+        self.load()
+
+    def order(self, branch_id=None, width=None, height=None):
+        """Порядок стратегий для фото: по филиалу, с поправкой на размер и общую статистику"""
+        prior = self._share(size_scope(width, height)) if width and height else {}
+        if not prior:
+            prior = self._share(GLOBAL_SCOPE)
+        branch = self._wins.get(branch_scope(branch_id), Counter()) if branch_id is not None else Counter()
+        rank = {name: i for i, name in enumerate(self.default_order)}
+
+        def score(name):
+            return (-(branch[name] + PRIOR_WEIGHT * prior.get(name, 0)), rank[name])
+
+        return tuple(sorted(self.default_order, key=score))
+
+    def record(self, strategy, branch_id=None, width=None, height=None):
+        """Учесть стратегию, прочитавшую код"""
+        if strategy not in self.default_order:
+            return
+        scopes = [GLOBAL_SCOPE]
+        if width and height:
+            scopes.append(size_scope(width, height))
+        if branch_id is not None:
+            scopes.append(branch_scope(branch_id))
+        for scope in scopes:
+            wins = self._wins.setdefault(scope, Counter())
+            wins[strategy] += 1
+            if sum(wins.values()) >= STATS_HALF_LIFE:
+                self._wins[scope] = Counter({k: v // 2 for k, v in wins.items() if v // 2})
+        self._dirty = True
+        if time.monotonic() - self._saved_at >= self.flush_interval:
+            self.save()
+
+    def _share(self, scope):
+        wins = self._wins.get(scope)
+        total = sum(wins.values()) if wins else 0
+        if not total:
+            return {}
+        return {name: count / total for name, count in wins.items()}
+
+    def load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logging.warning(f"Не удалось прочитать статистику стратегий QR {self.path}: {e}")
+            return
+        self._wins = {
+            scope: Counter({name: int(count) for name, count in wins.items() if name in self.default_order})
+            for scope, wins in data.items()
+            if isinstance(wins, dict)
+        }
+        logging.info(f"Статистика стратегий QR загружена: {len(self._wins)} разрез(ов)")
+
+    def save(self):
+        """Записать таблицу, если она менялась (через временный файл)"""
+        self._saved_at = time.monotonic()
+        if not self._dirty:
+            return
+        tmp_path = f"{self.path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._wins, f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+        except OSError as e:
+            logging.warning(f"Не удалось сохранить статистику стратегий QR {self.path}: {e}")
@@ -0,0 +1,73 @@
+"""
+Клиент Supabase в памяти для тестов кэшей (test_branch_catalog.py,
+test_user_directory.py, test_shift_state.py)
+
+Одна таблица со строками rows; запросы поддерживают select, eq, order
+и limit. Поведение базы настраивается атрибутами клиента:
+    fail      — execute() бросает ConnectionError;
+    delay     — execute() спит столько секунд (медленная база);
+    read_done — Event: строки прочитаны, ответ ждёт release («ещё в пути»).
+"""
+
+import threading
+import time
+
+
+class FakeResult:
+    def __init__(self, data):
+        self.data = data
+
+
+class FakeQuery:
+    def __init__(self, client):
+        self.client = client
+        self.filters = []
+        self.ordering = None
+        self.count = None
+
+    def select(self, *args, **kwargs):
+        return self
+
+    def eq(self, column, value):
+        self.filters.append((column, value))
+        return self
+
+    def order(self, column, desc=False):
+        self.ordering = (column, desc)
+        return self
+
+    def limit(self, n):
+        self.count = n
+        return self
+
+    def execute(self):
+        client = self.client
+        client.calls += 1
+        if client.fail:
+            raise ConnectionError("Supabase недоступен")
+        time.sleep(client.delay)
+        rows = [dict(row) for row in client.rows if all(row.get(c) == v for c, v in self.filters)]
+        if self.ordering:
+            column, desc = self.ordering
+            rows.sort(key=lambda row: row[column], reverse=desc)
+        if self.count is not None:
+            rows = rows[:self.count]
+        if client.read_done:
+            client.read_done.set()
+            client.release.wait(5)
+        return FakeResult(rows)
+
+
+class FakeClient:
+    def __init__(self, table, rows):
+        self.table_name = table
+        self.rows = rows
+        self.calls = 0
+        self.fail = False
+        self.delay = 0
+        self.read_done = None
+        self.release = threading.Event()
+
+    def table(self, name):
+        assert name == self.table_name
+        return FakeQuery(self)
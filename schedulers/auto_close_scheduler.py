@@ -6,6 +6,8 @@ import time
 from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
 import utils.httpx_proxy_patch
+from utils.branch_catalog import BranchCatalog
+from utils.shift_state import AUTO_CLOSE_TIME
 from supabase import create_client, Client
 from telegram import Bot
 from pathlib import Path
@@ -29,6 +31,7 @@ if not all([TELEGRAM_TOKEN, SUPABASE_URL, SUPABASE_KEY]):
     raise Exception("Не хватает переменных окружения!")
 
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+branch_catalog = BranchCatalog(supabase)
 bot = Bot(token=TELEGRAM_TOKEN)
 
 async def get_users_without_departure():
@@ -78,12 +81,12 @@ async def auto_close_workday():
         try:
             user_id = arrival_event["telegram_id"]
             user_name = f"{arrival_event['first_name']} {arrival_event['last_name']}"
-            branch_name = arrival_event["branch_name"]
+            branch_name = arrival_event.get("branch_name") or branch_catalog.name(arrival_event["branch_id"], f"Филиал {arrival_event['branch_id']}")
             arrival_time = datetime.fromisoformat(arrival_event["event_time"])
             
-            # Время автозакрытия - 21:00 сегодня по московскому времени
+            # Время автозакрытия - AUTO_CLOSE_TIME сегодня по московскому времени
             moscow_now = get_moscow_time()
-            close_time = datetime.combine(moscow_now.date(), datetime.strptime("21:00", "%H:%M").time(), MOSCOW_TZ)
+            close_time = datetime.combine(moscow_now.date(), datetime.strptime(AUTO_CLOSE_TIME, "%H:%M").time(), MOSCOW_TZ)
             
             # Рассчитать 8 часов работы
             work_hours = 8.0
@@ -114,7 +117,7 @@ async def auto_close_workday():
             if user_chat_id:
                 message = (
                     "🔴 АВТОМАТИЧЕСКОЕ ЗАКРЫТИЕ РАБОЧЕГО ДНЯ\n\n"
-                    f"Ваш рабочий день был автоматически закрыт в 21:00\n"
+                    f"Ваш рабочий день был автоматически закрыт в {AUTO_CLOSE_TIME}\n"
                     f"Филиал: {branch_name}\n"
                     f"Учтено рабочих часов: 8\n\n"
                     "⚠️ Информация о нарушении передана руководителю для проверки."
@@ -129,7 +132,7 @@ async def auto_close_workday():
                     f"Username: @{arrival_event['username']}\n"
                     f"Филиал: {branch_name}\n"
                     f"Время прихода: {arrival_time:%d.%m.%Y %H:%M}\n"
-                    f"Автозакрытие: 21:00\n"
+                    f"Автозакрытие: {AUTO_CLOSE_TIME}\n"
                     f"Учтено часов: 8\n\n"
                     "Требуется проверка нарушения."
                 )
@@ -141,10 +144,10 @@ async def auto_close_workday():
             print(f"Ошибка автозакрытия для пользователя {arrival_event.get('telegram_id')}: {e}")
 
 def schedule_auto_close():
-    """Запланировать автозакрытие на 21:00 каждый день"""
-    schedule.every().day.at("21:00").do(lambda: asyncio.run(auto_close_workday()))
+    """Запланировать автозакрытие на AUTO_CLOSE_TIME каждый день"""
+    schedule.every().day.at(AUTO_CLOSE_TIME).do(lambda: asyncio.run(auto_close_workday()))
     
-    print("Планировщик автозакрытия запущен. Автозакрытие в 21:00 каждый день.")
+    print(f"Планировщик автозакрытия запущен. Автозакрытие в {AUTO_CLOSE_TIME} каждый день.")
     
     while True:
         schedule.run_pending()
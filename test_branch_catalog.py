@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Тест общего справочника филиалов (utils/branch_catalog.py)
+"""
+
+import threading
+import time
+
+from fake_supabase import FakeClient
+from utils.branch_catalog import BranchCatalog
+
+
+def test_lookups_use_single_query():
+    """Повторные обращения в пределах TTL не ходят в базу"""
+    client = FakeClient("branches", [{"id": 1, "name": "Центр"}, {"id": 2, "name": "Север"}])
+    catalog = BranchCatalog(client, ttl=60)
+    assert catalog.name(1) == "Центр"
+    assert catalog.get(2)["name"] == "Север"
+    assert catalog.names() == {1: "Центр", 2: "Север"}
+    assert catalog.name(3, "нет") == "нет"
+    assert len(catalog.all()) == 2
+    assert client.calls == 1
+
+
+def test_stale_served_while_refreshing():
+    """После TTL отдаются старые данные, обновление идёт в фоне"""
+    client = FakeClient("branches", [{"id": 1, "name": "Центр"}])
+    catalog = BranchCatalog(client, ttl=0)
+    assert catalog.name(1) == "Центр"
+
+    client.rows = [{"id": 1, "name": "Центр-2"}]
+    client.delay = 0.2
+    started = time.monotonic()
+    assert catalog.name(1) == "Центр"
+    assert time.monotonic() - started < 0.1
+
+    deadline = time.monotonic() + 2
+    while catalog.name(1) != "Центр-2" and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert catalog.name(1) == "Центр-2"
+
+
+def test_stale_kept_when_supabase_down():
+    """Ошибка загрузки не затирает последние данные"""
+    client = FakeClient("branches", [{"id": 1, "name": "Центр"}])
+    catalog = BranchCatalog(client, ttl=60)
+    assert catalog.name(1) == "Центр"
+    client.fail = True
+    catalog.invalidate()
+    assert catalog.name(1) == "Центр"
+
+
+def test_invalidate_reloads():
+    """invalidate() заставляет перечитать таблицу"""
+    client = FakeClient("branches", [{"id": 1, "name": "Центр"}])
+    catalog = BranchCatalog(client, ttl=60)
+    catalog.all()
+    client.rows = [{"id": 1, "name": "Центр"}, {"id": 5, "name": "Юг"}]
+    catalog.invalidate()
+    assert catalog.name(5) == "Юг"
+    assert client.calls == 2
+
+
+def test_concurrent_first_load():
+    """Первая загрузка из нескольких потоков выполняется один раз"""
+    client = FakeClient("branches", [{"id": 1, "name": "Центр"}])
+    client.delay = 0.05
+    catalog = BranchCatalog(client, ttl=60)
+    threads = [threading.Thread(target=catalog.all) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert client.calls == 1
+
+
+def test_ready():
+    """ready(): данные в памяти (в том числе устаревшие), сброс и первая загрузка — нет"""
+    client = FakeClient("branches", [{"id": 1, "name": "Центр"}])
+    catalog = BranchCatalog(client, ttl=0.05)
+    assert not catalog.ready()
+    catalog.names()
+    assert catalog.ready()
+    time.sleep(0.1)
+    assert catalog.ready()
+    catalog.invalidate()
+    assert not catalog.ready()
+
+
+if __name__ == "__main__":
+    test_lookups_use_single_query()
+    test_stale_served_while_refreshing()
+    test_stale_kept_when_supabase_down()
+    test_invalidate_reloads()
+    test_concurrent_first_load()
+    test_ready()
+    print("✅ Все тесты справочника филиалов прошли")
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Тест асинхронного доступа к Supabase (utils/db_async.py)
+"""
+
+import asyncio
+import threading
+import time
+
+from utils.db_async import DB_POOL_SIZE, db_call, db_execute
+
+
+class SlowQuery:
+    def __init__(self, delay=0.2):
+        self.delay = delay
+        self.thread = None
+
+    def execute(self):
+        self.thread = threading.current_thread()
+        time.sleep(self.delay)
+        return "ok"
+
+
+def test_query_runs_off_event_loop():
+    """Запрос выполняется в пуле, цикл событий продолжает работать"""
+    async def main():
+        query = SlowQuery()
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        result = await db_execute(query)
+        task.cancel()
+        return query, result, ticks
+
+    query, result, ticks = asyncio.run(main())
+    assert result == "ok"
+    assert query.thread is not threading.main_thread()
+    assert ticks >= 5
+
+
+def test_queries_run_concurrently():
+    """Несколько медленных запросов ждут параллельно, а не по очереди"""
+    async def main():
+        started = time.monotonic()
+        await asyncio.gather(*(db_execute(SlowQuery()) for _ in range(min(4, DB_POOL_SIZE))))
+        return time.monotonic() - started
+
+    assert asyncio.run(main()) < 0.6
+
+
+def test_errors_propagate():
+    """Исключение из запроса пробрасывается в обработчик"""
+    def fail():
+        raise RuntimeError("Supabase недоступен")
+
+    async def main():
+        try:
+            await db_call(fail)
+        except RuntimeError as e:
+            return str(e)
+
+    assert asyncio.run(main()) == "Supabase недоступен"
+
+
+if __name__ == "__main__":
+    test_query_runs_off_event_loop()
+    test_queries_run_concurrently()
+    test_errors_propagate()
+    print("✅ Все тесты асинхронного доступа к базе прошли")
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Тест LRU-кэша со сроком жизни (utils/lru_cache.py)
+"""
+
+import time
+
+from utils.lru_cache import LRUCache
+
+
+def test_hit_and_empty_value():
+    """Пустой результат хранится и отличается от промаха"""
+    cache = LRUCache(max_entries=4, ttl=60)
+    cache.put("a", ())
+    assert cache.get("a") == ()
+    assert cache.get("b") is None
+    assert cache.get("b", "нет") == "нет"
+
+
+def test_least_recently_used_evicted():
+    """При переполнении вытесняется давно не использованная запись"""
+    cache = LRUCache(max_entries=2, ttl=60)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+
+
+def test_expiry_and_pop():
+    """Просроченные и удалённые записи не отдаются"""
+    cache = LRUCache(max_entries=4, ttl=0.05)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.pop("b")
+    assert cache.get("b") is None
+    time.sleep(0.06)
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+if __name__ == "__main__":
+    test_hit_and_empty_value()
+    test_least_recently_used_evicted()
+    test_expiry_and_pop()
+    print("✅ Все тесты LRU-кэша прошли")
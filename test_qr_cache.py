@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Тест кэша QR-изображений по окнам (web/qr_cache.py)
+"""
+
+import threading
+import time
+
+from web.qr_cache import QRWindowCache
+
+
+def test_cache_hit_skips_render():
+    """Повторный запрос в том же окне не вызывает рендер"""
+    cache = QRWindowCache()
+    calls = []
+
+    def render():
+        calls.append(1)
+        return b"png"
+
+    assert cache.get_or_render(1, 100, render) == b"png"
+    assert cache.get_or_render(1, 100, render) == b"png"
+    assert len(calls) == 1
+
+
+def test_old_windows_evicted():
+    """Окна старше keep_windows вытесняются"""
+    cache = QRWindowCache(keep_windows=2)
+    for window in (100, 101, 102):
+        cache.get_or_render(1, window, lambda: b"png")
+    assert cache.get(1, 100) is None
+    assert cache.get(1, 101) == b"png"
+    assert cache.get(1, 102) == b"png"
+
+
+def test_size_bounded():
+    """Размер кэша не превышает max_entries"""
+    cache = QRWindowCache(max_entries=3)
+    for branch_id in range(10):
+        cache.get_or_render(branch_id, 100, lambda: b"png")
+    assert len(cache) == 3
+
+
+def test_failed_render_not_cached():
+    """None из рендера не кэшируется"""
+    cache = QRWindowCache()
+    assert cache.get_or_render(1, 100, lambda: None) is None
+    assert cache.get(1, 100) is None
+
+
+def test_concurrent_misses_collapsed():
+    """Параллельные промахи по одному ключу дают один рендер"""
+    cache = QRWindowCache()
+    calls = []
+    barrier = threading.Barrier(8)
+
+    def render():
+        calls.append(1)
+        time.sleep(0.05)
+        return b"png"
+
+    def worker(results):
+        barrier.wait()
+        results.append(cache.get_or_render(1, 100, render))
+
+    results = []
+    threads = [threading.Thread(target=worker, args=(results,)) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert results == [b"png"] * 8
+    assert len(calls) == 1
+
+
+if __name__ == "__main__":
+    test_cache_hit_skips_render()
+    test_old_windows_evicted()
+    test_size_bounded()
+    test_failed_render_not_cached()
+    test_concurrent_misses_collapsed()
+    print("✅ Все тесты кэша QR прошли")
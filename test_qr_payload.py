@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Тест форматов данных QR-кода v1/v2 (utils/qr_payload.py)
+"""
+
+import base64
+import json
+
+import cv2
+import numpy as np
+import qrcode
+
+from utils import qr_payload
+
+SECRET = "qr_secret_2025"
+
+
+def make_v1(branch_id, branch_name, time_window):
+    """QR v1 в том виде, в каком его печатали терминалы до v2"""
+    payload = {
+        "branch_id": branch_id,
+        "branch_name": branch_name,
+        "timestamp": time_window,
+        "expires": time_window * 30 + 120,
+        "signature": qr_payload.sign_v1(SECRET, branch_id, time_window),
+        "generated_at": time_window * 30,
+    }
+    return base64.urlsafe_b64encode(json.dumps(payload, ensure_ascii=False).encode()).decode()
+
+
+def test_v2_roundtrip():
+    """v2 собирается и разбирается с верной подписью"""
+    data = qr_payload.encode_v2(SECRET, 7, 59742357)
+    payload = qr_payload.parse(data)
+    assert payload["version"] == 2
+    assert payload["branch_id"] == 7
+    assert payload["timestamp"] == 59742357
+    assert payload["expires"] == 59742357 * 30 + qr_payload.QR_TTL
+    assert qr_payload.verify(SECRET, payload)
+
+
+def test_v2_is_alphanumeric():
+    """Все символы v2 входят в alphanumeric-режим QR"""
+    data = qr_payload.encode_v2(SECRET, 123456, 59742357)
+    assert all(c.encode() in qrcode.util.ALPHA_NUM for c in data)
+
+
+def test_v2_rejects_tampering():
+    """Подмена филиала или чужой секрет ломают подпись"""
+    payload = qr_payload.parse(qr_payload.encode_v2(SECRET, 7, 100))
+    assert not qr_payload.verify("other_secret", payload)
+    payload["branch_id"] = 8
+    assert not qr_payload.verify(SECRET, payload)
+
+
+def test_v2_rejects_garbage():
+    """Повреждённые данные дают ValueError"""
+    for data in ("2", "2ABC", "2!!!!", qr_payload.encode_v2(SECRET, 1, 1)[:-4]):
+        try:
+            qr_payload.parse(data)
+        except ValueError:
+            continue
+        raise AssertionError(f"ожидалась ошибка для {data!r}")
+
+
+def test_v1_still_accepted():
+    """Старые QR v1 разбираются и проходят проверку"""
+    payload = qr_payload.parse(make_v1(1, "Тестовый филиал", 59742357))
+    assert payload["version"] == 1
+    assert payload["branch_name"] == "Тестовый филиал"
+    assert qr_payload.verify(SECRET, payload)
+
+
+def test_v2_smaller_qr_version():
+    """v2 даёт QR заметно меньшей версии, чем v1"""
+    def version(data):
+        qr = qrcode.QRCode()
+        qr.add_data(f"{qr_payload.QR_PREFIX}{data}")
+        qr.make(fit=True)
+        return qr.version
+
+    v1 = version(make_v1(1, "Тестовый филиал на Баумана", 59742357))
+    v2 = version(qr_payload.encode_v2(SECRET, 1, 59742357))
+    assert v2 <= 3 < v1
+
+
+
+def test_not_yet_valid_at_window_boundary():
+    """Код следующего окна принимается за пару секунд до его начала — часы веба и бота расходятся"""
+    start = 59742358 * qr_payload.QR_TIME_WINDOW
+    assert not qr_payload.not_yet_valid(59742358, start)
+    assert not qr_payload.not_yet_valid(59742358, start - qr_payload.QR_CLOCK_SKEW)
+    assert qr_payload.not_yet_valid(59742358, start - qr_payload.QR_CLOCK_SKEW - 1)
+    assert qr_payload.not_yet_valid(59742359, start)
+    assert not qr_payload.not_yet_valid(59742357, start)
+
+
+def test_find_ours_among_two_codes_in_frame():
+    """Ссылка на корпусе киоска рядом с нашим кодом: берётся наш, в каком бы порядке их ни прочитали"""
+    ours = qr_payload.QR_PREFIX + qr_payload.encode_v2(SECRET, 3, 59742357)
+    link = "https://example.com/kiosk"
+    codes = [np.array(qrcode.make(text, box_size=6).convert("L")) for text in (link, ours)]
+    frame = np.full((codes[0].shape[0] + 40, sum(c.shape[1] for c in codes) + 60), 255, np.uint8)
+    x = 20
+    for code in codes:
+        frame[20:20 + code.shape[0], x:x + code.shape[1]] = code
+        x += code.shape[1] + 20
+    ok, texts, points, _ = cv2.QRCodeDetector().detectAndDecodeMulti(frame)
+    assert ok
+    # Слева направо: чужой код первым — pyzbar тоже может отдать его раньше нашего
+    decoded = [text.encode() for _, text in sorted(zip(points[:, 0, 0], texts))]
+    assert decoded == [link.encode(), ours.encode()]
+    assert qr_payload.find(decoded) == ours.encode()
+    assert qr_payload.find(decoded[::-1]) == ours.encode()
+    assert qr_payload.find([link.encode()]) is None
+    assert qr_payload.find([]) is None
+
+if __name__ == "__main__":
+    test_v2_roundtrip()
+    test_v2_is_alphanumeric()
+    test_v2_rejects_tampering()
+    test_v2_rejects_garbage()
+    test_v1_still_accepted()
+    test_v2_smaller_qr_version()
+    test_not_yet_valid_at_window_boundary()
+    test_find_ours_among_two_codes_in_frame()
+    print("✅ Все тесты формата QR прошли")
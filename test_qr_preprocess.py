@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Тест предобработки трудных фото QR-кода (bot/qr_preprocess.py)
+"""
+
+import cv2
+import numpy as np
+import qrcode
+
+from bot.qr_preprocess import Preprocessor
+
+# Методы, которые используют стратегии glare, adaptive и unsharp (bot/qr_decoder.py)
+STRATEGY_METHODS = ("suppress_glare", "adaptive_threshold", "unsharp")
+
+
+def make_qr():
+    img = qrcode.make("/qr_2AAAAAAIDR6MKDKWCBOPMSJTKLJGQA", box_size=8).convert("L")
+    return np.array(img)
+
+
+def with_glare(qr, glare=120, contrast=0.3, noise=8):
+    """Экран под лампой: низкий контраст, яркое пятно, шум"""
+    h, w = qr.shape
+    yy, xx = np.mgrid[0:h, 0:w]
+    img = qr.astype(np.float32) * contrast + 255 * (1 - contrast) / 2
+    img += glare * np.exp(-((xx - w * 0.35) ** 2 + (yy - h * 0.4) ** 2) / (2 * (w * 0.25) ** 2))
+    img += np.random.default_rng(1).normal(0, noise, img.shape)
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+
+def test_variants_are_binary():
+    """Все варианты — чёрно-белые изображения исходного размера"""
+    qr = make_qr()
+    pre = Preprocessor()
+    for method in STRATEGY_METHODS:
+        variant = getattr(pre, method)(with_glare(qr))
+        assert variant.shape == qr.shape
+        assert set(np.unique(variant)) <= {0, 255}
+
+
+def test_glare_suppression_beats_global_threshold():
+    """Выравнивание освещения восстанавливает модули под бликом"""
+    qr = make_qr()
+    photo = with_glare(qr)
+    _, plain = cv2.threshold(photo, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    restored = Preprocessor().suppress_glare(photo)
+    assert (restored == qr).mean() > 0.95
+    assert (restored == qr).mean() > (plain == qr).mean() + 0.2
+
+
+def test_buffers_are_reused():
+    """Попытки пишут в одни и те же буферы, пока размер изображения не меняется"""
+    qr = make_qr()
+    pre = Preprocessor()
+    first = [id(getattr(pre, method)(with_glare(qr))) for method in STRATEGY_METHODS]
+    second = [id(getattr(pre, method)(with_glare(qr, glare=60))) for method in STRATEGY_METHODS]
+    assert len(set(first + second)) == 1
+    other = pre.adaptive_threshold(np.full((100, 120), 200, dtype=np.uint8))
+    assert other.shape == (100, 120)
+
+
+
+def test_buffers_kept_per_shape():
+    """Область кода и весь кадр по очереди: буферы каждого размера переиспользуются"""
+    pre = Preprocessor()
+    roi = with_glare(make_qr())
+    frame = np.full((480, 640), 200, dtype=np.uint8)
+    frame[50:50 + roi.shape[0], 100:100 + roi.shape[1]] = roi
+    first = {source.shape: pre.unsharp(source) for source in (roi, frame)}
+    for _ in range(3):
+        for source in (roi, frame):
+            for method in STRATEGY_METHODS:
+                assert getattr(pre, method)(source) is first[source.shape]
+
+if __name__ == "__main__":
+    test_variants_are_binary()
+    test_glare_suppression_beats_global_threshold()
+    test_buffers_are_reused()
+    test_buffers_kept_per_shape()
+    print("✅ Все тесты предобработки прошли")
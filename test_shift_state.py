@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Тест кэша состояния смены (utils/shift_state.py)
+"""
+
+import asyncio
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from fake_supabase import FakeClient
+from utils.shift_state import MOSCOW_TZ, ShiftStateCache, auto_close_cutoff
+
+
+ARRIVAL = {"telegram_id": 1, "event_type": "arrival", "branch_id": 7, "event_time": "2024-05-06T09:00:00+03:00"}
+DEPARTURE = {"telegram_id": 1, "event_type": "departure", "branch_id": 7, "event_time": "2024-05-06T18:00:00+03:00"}
+
+
+def test_single_query_per_user():
+    """Повторные запросы состояния не ходят в базу"""
+    client = FakeClient("time_events", [ARRIVAL])
+    cache = ShiftStateCache(client, ttl=60)
+
+    async def main():
+        first = await cache.get(1)
+        second = await cache.get(1)
+        return first, second
+
+    first, second = asyncio.run(main())
+    assert first["last_event_type"] == "arrival"
+    assert second["open_arrival"]["branch_id"] == 7
+    assert client.calls == 1
+
+
+def test_record_is_write_through():
+    """Записанный уход закрывает смену без обращения к базе"""
+    client = FakeClient("time_events", [ARRIVAL])
+    cache = ShiftStateCache(client, ttl=60)
+
+    async def main():
+        await cache.get(1)
+        cache.record(1, DEPARTURE)
+        return await cache.get(1)
+
+    state = asyncio.run(main())
+    assert state == {"last_event_type": "departure", "open_arrival": None}
+    assert client.calls == 1
+
+
+def test_no_events_and_invalidate():
+    """Пользователь без событий; invalidate() перечитывает состояние"""
+    client = FakeClient("time_events", [])
+    cache = ShiftStateCache(client, ttl=60)
+
+    async def main():
+        empty = await cache.get(1)
+        client.rows.append(ARRIVAL)
+        cache.invalidate(1)
+        return empty, await cache.get(1)
+
+    empty, state = asyncio.run(main())
+    assert empty == {"last_event_type": None, "open_arrival": None}
+    assert state["last_event_type"] == "arrival"
+    assert client.calls == 2
+
+
+@contextmanager
+def local_timezone(tz):
+    """Локальные часы процесса, как TZ в контейнере"""
+    saved = os.environ.get("TZ")
+    os.environ["TZ"] = tz
+    time.tzset()
+    try:
+        yield
+    finally:
+        if saved is None:
+            os.environ.pop("TZ", None)
+        else:
+            os.environ["TZ"] = saved
+        time.tzset()
+
+
+def test_auto_close_cutoff():
+    """Граница автозакрытия: 21:00 с запасом, до неё — вчерашняя"""
+    with local_timezone("MSK-3"):
+        evening = datetime(2024, 5, 6, 22, 0, tzinfo=MOSCOW_TZ)
+        assert auto_close_cutoff(evening) == datetime(2024, 5, 6, 21, 10, tzinfo=MOSCOW_TZ)
+        morning = datetime(2024, 5, 7, 9, 0, tzinfo=MOSCOW_TZ)
+        assert auto_close_cutoff(morning) == datetime(2024, 5, 6, 21, 10, tzinfo=MOSCOW_TZ)
+        during_grace = datetime(2024, 5, 6, 21, 5, tzinfo=MOSCOW_TZ)
+        assert auto_close_cutoff(during_grace) == datetime(2024, 5, 5, 21, 10, tzinfo=MOSCOW_TZ)
+
+
+def test_cutoff_follows_container_clock():
+    """В контейнере с UTC планировщик срабатывает в 21:00 UTC (00:00 МСК) — граница там же"""
+    with local_timezone("UTC"):
+        late_evening = datetime(2024, 5, 6, 23, 0, tzinfo=MOSCOW_TZ)
+        assert auto_close_cutoff(late_evening) == datetime(2024, 5, 5, 21, 10, tzinfo=timezone.utc)
+        after_run = datetime(2024, 5, 7, 0, 15, tzinfo=MOSCOW_TZ)
+        assert auto_close_cutoff(after_run) == datetime(2024, 5, 6, 21, 10, tzinfo=timezone.utc)
+
+
+if __name__ == "__main__":
+    test_single_query_per_user()
+    test_record_is_write_through()
+    test_no_events_and_invalidate()
+    test_auto_close_cutoff()
+    test_cutoff_follows_container_clock()
+    print("✅ Все тесты состояния смены прошли")
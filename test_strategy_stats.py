@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Тест статистики стратегий распознавания QR (bot/strategy_stats.py)
+"""
+
+import json
+import os
+import tempfile
+
+from bot.strategy_stats import STATS_HALF_LIFE, StrategyStats
+
+ORDER = ("roi", "frame", "glare", "adaptive", "unsharp", "downscale", "upscale")
+
+
+def make_stats(directory, **kwargs):
+    return StrategyStats(ORDER, path=os.path.join(directory, "stats.json"), **kwargs)
+
+
+def test_default_order_without_stats():
+    """Без статистики порядок не меняется"""
+    with tempfile.TemporaryDirectory() as directory:
+        stats = make_stats(directory)
+        assert stats.order() == ORDER
+        assert stats.order(branch_id=3, width=1280, height=960) == ORDER
+
+
+def test_branch_order_learned():
+    """У филиала с бликом первой идёт стратегия подавления бликов, у остальных — общий порядок"""
+    with tempfile.TemporaryDirectory() as directory:
+        stats = make_stats(directory)
+        for _ in range(10):
+            stats.record("glare", branch_id=3, width=1280, height=960)
+        for _ in range(30):
+            stats.record("roi", branch_id=5, width=1280, height=960)
+        assert stats.order(branch_id=3)[0] == "glare"
+        assert stats.order(branch_id=5)[0] == "roi"
+        # Неизвестный филиал: общая статистика по размеру фото
+        assert stats.order(branch_id=9, width=1200, height=900)[:2] == ("roi", "glare")
+
+
+def test_old_wins_decay():
+    """Старые победы со временем весят меньше: порядок следует за сменой условий"""
+    with tempfile.TemporaryDirectory() as directory:
+        stats = make_stats(directory)
+        for _ in range(STATS_HALF_LIFE - 1):
+            stats.record("adaptive", branch_id=3)
+        for _ in range(STATS_HALF_LIFE):
+            stats.record("unsharp", branch_id=3)
+        assert stats.order(branch_id=3)[0] == "unsharp"
+
+
+def test_persisted_between_restarts():
+    """Таблица сохраняется в JSON и загружается при следующем запуске"""
+    with tempfile.TemporaryDirectory() as directory:
+        stats = make_stats(directory, flush_interval=0)
+        stats.record("downscale", branch_id=3)
+        stats.record("removed_strategy", branch_id=3)
+        with open(stats.path, encoding="utf-8") as f:
+            assert json.load(f)["b3"] == {"downscale": 1}
+        assert make_stats(directory).order(branch_id=3)[0] == "downscale"
+
+
+if __name__ == "__main__":
+    test_default_order_without_stats()
+    test_branch_order_learned()
+    test_old_wins_decay()
+    test_persisted_between_restarts()
+    print("✅ Все тесты статистики стратегий прошли")
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Тест справочника пользователей бота (utils/user_directory.py)
+"""
+
+import asyncio
+import threading
+import time
+
+from fake_supabase import FakeClient
+from utils.user_directory import UserDirectory
+
+
+USERS = [
+    {"telegram_id": 1, "username": "boss", "role": "superuser", "status": "approved"},
+    {"telegram_id": 2, "username": "anna", "role": "admin", "status": "approved"},
+    {"telegram_id": 3, "username": None, "role": "user", "status": "pending"},
+]
+
+
+def test_indexes_from_single_query():
+    """Поиск по id, username и ролям — один запрос к базе"""
+    client = FakeClient("users", USERS)
+    directory = UserDirectory(client, ttl=60)
+
+    async def main():
+        assert (await directory.get(2))["username"] == "anna"
+        assert await directory.get(99) is None
+        assert (await directory.by_username("boss"))["telegram_id"] == 1
+        admins = await directory.with_roles("admin", "superuser")
+        assert sorted(u["telegram_id"] for u in admins) == [1, 2]
+        assert len(await directory.all()) == 3
+
+    asyncio.run(main())
+    assert client.calls == 1
+
+
+def test_invalidate_after_change():
+    """После invalidate() изменения видны сразу"""
+    client = FakeClient("users", [dict(u) for u in USERS])
+    directory = UserDirectory(client, ttl=60)
+
+    async def main():
+        assert (await directory.get(3))["status"] == "pending"
+        client.rows[2]["status"] = "approved"
+        assert (await directory.get(3))["status"] == "pending"
+        directory.invalidate()
+        return await directory.get(3)
+
+    assert asyncio.run(main())["status"] == "approved"
+    assert client.calls == 2
+
+
+def test_invalidate_during_background_refresh():
+    """invalidate() во время фонового обновления не теряется: отклонённый пользователь не остаётся одобренным"""
+    client = FakeClient("users", [dict(u) for u in USERS])
+    directory = UserDirectory(client, ttl=0.05)
+
+    async def main():
+        assert (await directory.get(2))["status"] == "approved"
+        time.sleep(0.1)
+        client.read_done = threading.Event()
+        await directory.get(2)                 # запускает фоновое обновление
+        assert client.read_done.wait(5)
+        client.read_done = None
+        client.rows[1]["status"] = "declined"
+        directory.invalidate()
+        client.release.set()                   # обновление записывает строки до изменения
+        return await directory.get(2)
+
+    assert asyncio.run(main())["status"] == "declined"
+    assert client.calls == 3
+
+
+def test_failed_reload_after_invalidate():
+    """Если перечитать после invalidate() не удалось, старые данные не отдаются"""
+    client = FakeClient("users", [dict(u) for u in USERS])
+    directory = UserDirectory(client, ttl=60)
+
+    async def main():
+        await directory.get(2)
+        client.rows[1]["status"] = "declined"
+        directory.invalidate()
+        client.fail = True
+        for _ in range(2):
+            try:
+                await directory.get(2)
+            except ConnectionError:
+                pass
+            else:
+                raise AssertionError("отдано сброшенное значение")
+        client.fail = False
+        return await directory.get(2)
+
+    assert asyncio.run(main())["status"] == "declined"
+    assert client.calls == 4
+
+
+if __name__ == "__main__":
+    test_indexes_from_single_query()
+    test_invalidate_after_change()
+    test_invalidate_during_background_refresh()
+    test_failed_reload_after_invalidate()
+    print("✅ Все тесты справочника пользователей прошли")
@@ -0,0 +1,54 @@
+# utils/branch_catalog.py
+"""Общий справочник филиалов для web, бота и планировщиков."""
+
+import os
+
+from utils.ttl_cache import RefreshingValue
+
+BRANCH_CACHE_TTL = int(os.environ.get("BRANCH_CACHE_TTL", "300"))
+
+
+class BranchCatalog:
+    """Филиалы из таблицы 'branches' в памяти процесса.
+
+    Таблица почти не меняется, поэтому данные живут BRANCH_CACHE_TTL секунд,
+    после чего обновляются в фоне; до окончания обновления (и при
+    недоступности Supabase) отдаются последние загруженные данные.
+
+    Кэш свой у каждого процесса: invalidate() не доходит до других
+    воркеров gunicorn и до бота, они увидят правки через свой ttl.
+    """
+
+    def __init__(self, client, ttl=BRANCH_CACHE_TTL):
+        self._client = client
+        self._snapshot = RefreshingValue(self._load, ttl, default=([], {}), name="branches")
+
+    def _load(self):
+        res = self._client.table("branches").select("*").execute()
+        branches = list(res.data or [])
+        return branches, {b["id"]: b for b in branches}
+
+    def ready(self):
+        """True, если данные в памяти и вызов не пойдёт в Supabase"""
+        return self._snapshot.ready()
+
+    def all(self):
+        """Список филиалов (словари строк таблицы)"""
+        return self._snapshot.get()[0]
+
+    def get(self, branch_id):
+        """Филиал по id или None"""
+        return self._snapshot.get()[1].get(branch_id)
+
+    def name(self, branch_id, default=None):
+        """Название филиала по id"""
+        branch = self.get(branch_id)
+        return branch["name"] if branch else default
+
+    def names(self):
+        """Словарь id → название"""
+        return {branch_id: b["name"] for branch_id, b in self._snapshot.get()[1].items()}
+
+    def invalidate(self):
+        """Сбросить кэш после изменения филиалов"""
+        self._snapshot.invalidate()
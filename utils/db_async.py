@@ -0,0 +1,29 @@
+# utils/db_async.py
+"""Асинхронные обращения к Supabase из обработчиков бота.
+
+Клиент supabase-py синхронный: вызов .execute() прямо в async-обработчике
+останавливает цикл событий python-telegram-bot на всё время запроса.
+Здесь запросы выполняются в ограниченном пуле потоков, а обработчик
+ждёт результат через await, не мешая остальным апдейтам.
+"""
+
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Сколько запросов к PostgREST может выполняться одновременно
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "8"))
+
+_executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="supabase")
+
+
+async def db_call(func, *args, **kwargs):
+    """Выполнить синхронную функцию в пуле потоков базы"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+
+async def db_execute(query):
+    """Выполнить собранный запрос postgrest: await db_execute(supabase.table(...).select(...))"""
+    return await db_call(query.execute)
@@ -0,0 +1,47 @@
+# utils/lru_cache.py
+"""LRU-кэш с ограничением по размеру и сроком жизни записей."""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Не больше max_entries записей, каждая живёт ttl секунд.
+
+    get() возвращает default для отсутствующих и просроченных ключей,
+    поэтому значения вроде пустого списка хранятся как обычные.
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()   # ключ → (значение, monotonic истечения)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            value, expires = entry
+            if time.monotonic() >= expires:
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
@@ -0,0 +1,115 @@
+# utils/qr_payload.py
+"""Формат данных QR-кода терминала: сборка и разбор (v1 и v2).
+
+v1 — base64(JSON) с названием филиала и полной HMAC-SHA256 подписью.
+v2 — компактный: "2" + base32(branch_id, time_window, усечённый MAC).
+Все символы v2 входят в алфавит alphanumeric-режима QR, поэтому код
+получается заметно меньшей версии и лучше читается с фото.
+"""
+
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import struct
+
+QR_PREFIX = "/qr_"
+QR_TIME_WINDOW = 30       # секунд в одном окне
+QR_TTL = 120              # срок жизни кода от начала окна, секунд
+QR_CLOCK_SKEW = 2         # допуск расхождения часов веба и бота, секунд
+
+V2_MARKER = "2"
+_V2_FIELDS = struct.Struct(">II")   # branch_id, time_window
+_V2_MAC_SIZE = 10                   # 80 бит MAC достаточно для кода, живущего 2 минуты
+_V2_MAC_DOMAIN = b"qr2:"
+
+
+def sign_v1(secret, branch_id, time_window):
+    """HMAC-SHA256 подпись v1 (hex)"""
+    msg = f"{branch_id}:{time_window}".encode()
+    return hmac.new(secret.encode(), msg, hashlib.sha256).hexdigest()
+
+
+def sign_v2(secret, branch_id, time_window):
+    """Усечённый HMAC-SHA256 для v2 (bytes)"""
+    msg = _V2_MAC_DOMAIN + _V2_FIELDS.pack(branch_id, time_window)
+    return hmac.new(secret.encode(), msg, hashlib.sha256).digest()[:_V2_MAC_SIZE]
+
+
+def encode_v2(secret, branch_id, time_window):
+    """Собрать данные QR v2 (без префикса /qr_)"""
+    raw = _V2_FIELDS.pack(branch_id, time_window) + sign_v2(secret, branch_id, time_window)
+    return V2_MARKER + base64.b32encode(raw).decode().rstrip("=")
+
+
+def window_expires(time_window):
+    """Момент истечения кода окна time_window (unix-время)"""
+    return time_window * QR_TIME_WINDOW + QR_TTL
+
+
+def not_yet_valid(time_window, now_ts, skew=QR_CLOCK_SKEW):
+    """Окно кода ещё не началось (с допуском skew секунд на расхождение часов)"""
+    return time_window * QR_TIME_WINDOW > now_ts + skew
+
+
+def find(decoded):
+    """Первый наш код (/qr_..., bytes) среди прочитанных с одного кадра или None"""
+    prefix = QR_PREFIX.encode()
+    return next((data for data in decoded if data.startswith(prefix)), None)
+
+
+def parse(data):
+    """Разобрать данные QR (без префикса /qr_) любой версии.
+
+    Возвращает словарь с ключами version, branch_id, branch_name (только v1),
+    timestamp (номер окна), expires и signature. Подпись не проверяется.
+    При повреждённых данных бросает ValueError.
+    """
+    if data.startswith(V2_MARKER):
+        return _parse_v2(data[len(V2_MARKER):])
+    return _parse_v1(data)
+
+
+def _parse_v1(data):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(data.encode()).decode())
+    except (binascii.Error, UnicodeError, ValueError) as e:
+        raise ValueError(f"некорректные данные QR v1: {e}") from e
+    if not isinstance(payload, dict):
+        raise ValueError("некорректные данные QR v1: ожидался объект")
+    payload["version"] = 1
+    return payload
+
+
+def _parse_v2(data):
+    encoded = data.strip().upper()
+    try:
+        raw = base64.b32decode(encoded + "=" * (-len(encoded) % 8))
+    except (binascii.Error, ValueError) as e:
+        raise ValueError(f"некорректные данные QR v2: {e}") from e
+    if len(raw) != _V2_FIELDS.size + _V2_MAC_SIZE:
+        raise ValueError(f"некорректная длина QR v2: {len(raw)}")
+    branch_id, time_window = _V2_FIELDS.unpack_from(raw)
+    return {
+        "version": 2,
+        "branch_id": branch_id,
+        "branch_name": None,
+        "timestamp": time_window,
+        "expires": window_expires(time_window),
+        "signature": raw[_V2_FIELDS.size:].hex(),
+    }
+
+
+def verify(secret, payload):
+    """Проверить подпись разобранных данных QR"""
+    branch_id = payload.get("branch_id")
+    time_window = payload.get("timestamp")
+    signature = payload.get("signature")
+    if not isinstance(signature, str):
+        return False
+    if payload.get("version") == 2:
+        expected = sign_v2(secret, branch_id, time_window).hex()
+    else:
+        expected = sign_v1(secret, branch_id, time_window)
+    return hmac.compare_digest(signature, expected)
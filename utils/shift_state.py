@@ -0,0 +1,99 @@
+# utils/shift_state.py
+"""Состояние смены сотрудника в памяти бота.
+
+Для одного сканирования бот раньше несколько раз спрашивал time_events:
+тип последнего события, последний приход и наличие ухода после него.
+Всё это выводится из одного последнего события пользователя, поэтому
+состояние загружается одним запросом и дальше обновляется при записи
+событий самим ботом.
+
+Уходы в AUTO_CLOSE_TIME пишет планировщик автозакрытия в отдельном процессе,
+поэтому состояния, загруженные до последнего автозакрытия, считаются
+устаревшими и перечитываются.
+"""
+
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+from utils.db_async import db_execute
+
+MOSCOW_TZ = timezone(timedelta(hours=3))
+
+# Время ежедневного автозакрытия рабочего дня (общее для бота и планировщика).
+# schedule запускает его по локальным часам контейнера: в образе без TZ это UTC
+AUTO_CLOSE_TIME = "21:00"
+# Запас на работу планировщика после AUTO_CLOSE_TIME
+AUTO_CLOSE_GRACE = timedelta(minutes=10)
+# Страховка от правок time_events в обход бота
+SHIFT_STATE_TTL = int(os.environ.get("SHIFT_STATE_TTL", "3600"))
+
+
+def auto_close_cutoff(now):
+    """Момент, до которого загруженные состояния могли не увидеть автозакрытие.
+
+    Граница считается по локальным часам процесса — по ним же планировщик
+    (тот же образ) запускает автозакрытие.
+    """
+    hour, minute = map(int, AUTO_CLOSE_TIME.split(":"))
+    moment = now.astimezone() - AUTO_CLOSE_GRACE
+    boundary = moment.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if boundary > moment:
+        boundary -= timedelta(days=1)
+    return boundary + AUTO_CLOSE_GRACE
+
+
+class ShiftStateCache:
+    """Состояние смены по telegram_id: тип последнего события и открытый приход.
+
+    get() возвращает словарь {"last_event_type": ..., "open_arrival": ...},
+    где open_arrival — строка time_events прихода без ухода или None.
+    """
+
+    def __init__(self, client, ttl=SHIFT_STATE_TTL):
+        self._client = client
+        self.ttl = ttl
+        self._states = {}   # telegram_id → (состояние, monotonic загрузки, время загрузки МСК)
+
+    async def get(self, user_id):
+        entry = self._states.get(user_id)
+        if entry and self._is_fresh(entry):
+            return entry[0]
+        result = await db_execute(
+            self._client.table("time_events").select("*").eq("telegram_id", user_id)
+            .order("event_time", desc=True).limit(1)
+        )
+        last_event = result.data[0] if result.data else None
+        state = self._state_from(last_event)
+        self._put(user_id, state)
+        return state
+
+    def record(self, user_id, event):
+        """Учесть событие, только что записанное в time_events"""
+        self._put(user_id, self._state_from(event))
+
+    def invalidate(self, user_id=None):
+        """Забыть состояние пользователя (или всех)"""
+        if user_id is None:
+            self._states.clear()
+        else:
+            self._states.pop(user_id, None)
+
+    def _put(self, user_id, state):
+        self._states[user_id] = (state, time.monotonic(), datetime.now(MOSCOW_TZ))
+
+    def _is_fresh(self, entry):
+        _, loaded_monotonic, loaded_at = entry
+        if time.monotonic() - loaded_monotonic >= self.ttl:
+            return False
+        return loaded_at >= auto_close_cutoff(datetime.now(MOSCOW_TZ))
+
+    @staticmethod
+    def _state_from(last_event):
+        if not last_event:
+            return {"last_event_type": None, "open_arrival": None}
+        event_type = last_event.get("event_type")
+        return {
+            "last_event_type": event_type,
+            "open_arrival": last_event if event_type == "arrival" else None,
+        }
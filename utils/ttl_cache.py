@@ -0,0 +1,108 @@
+# utils/ttl_cache.py
+"""Значение в памяти с TTL и фоновым обновлением (stale-while-revalidate)."""
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class RefreshingValue:
+    """Кэширует результат loader() на ttl секунд.
+
+    Пока значение свежее — отдаётся из памяти. Устаревшее значение тоже
+    отдаётся сразу, а loader() запускается в фоновом потоке. Синхронная
+    загрузка происходит только когда значения ещё нет или после
+    invalidate(). Ошибка loader() не затирает последнее удачное значение.
+    С stale_on_error=False ошибка загрузки после invalidate() пробрасывается:
+    сброшенное значение больше не отдаётся (нужно, когда устаревшие данные
+    опаснее ошибки — например, права пользователей).
+
+    invalidate() увеличивает номер поколения. Загрузка, начатая до
+    invalidate(), записывает свой результат, но не снимает сброс: данные
+    могли быть прочитаны до изменения.
+    """
+
+    def __init__(self, loader, ttl, default=None, name=None, stale_on_error=True):
+        self._loader = loader
+        self._stale_on_error = stale_on_error
+        self.ttl = ttl
+        self._default = default
+        self._name = name or getattr(loader, "__qualname__", "value")
+        self._value = None
+        self._has_value = False
+        self._loaded_at = 0.0
+        self._invalidated = False
+        self._generation = 0
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self._has_value and not self._invalidated:
+                if time.monotonic() - self._loaded_at >= self.ttl and not self._refreshing:
+                    self._refreshing = True
+                    threading.Thread(
+                        target=self._refresh_in_background,
+                        name=f"refresh-{self._name}",
+                        daemon=True,
+                    ).start()
+                return self._value
+        return self._load_now()
+
+    def ready(self):
+        """True, если get() вернёт значение сразу, без синхронной загрузки"""
+        with self._lock:
+            return self._has_value and not self._invalidated
+
+    def invalidate(self):
+        """Следующий get() перечитает данные синхронно"""
+        with self._lock:
+            self._generation += 1
+            self._invalidated = True
+
+    def age(self):
+        """Возраст значения в секундах (None, если ещё не загружено)"""
+        with self._lock:
+            return time.monotonic() - self._loaded_at if self._has_value else None
+
+    def _load_now(self):
+        with self._load_lock:
+            with self._lock:
+                # Пока ждали лок, значение мог загрузить другой поток
+                if self._has_value and not self._invalidated:
+                    return self._value
+            with self._lock:
+                # Значение есть, но сброшено invalidate()
+                invalidated = self._has_value
+            self._load(raise_errors=invalidated and not self._stale_on_error)
+            with self._lock:
+                return self._value if self._has_value else self._default
+
+    def _refresh_in_background(self):
+        try:
+            with self._load_lock:
+                self._load()
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _load(self, raise_errors=False):
+        with self._lock:
+            generation = self._generation
+        try:
+            value = self._loader()
+        except Exception:
+            logger.exception("Ошибка обновления кэша %s", self._name)
+            # Сброс не снимается: следующий get() снова попробует загрузить
+            if raise_errors:
+                raise
+            return
+        with self._lock:
+            self._value = value
+            self._has_value = True
+            self._loaded_at = time.monotonic()
+            if self._generation == generation:
+                self._invalidated = False
@@ -0,0 +1,67 @@
+# utils/user_directory.py
+"""Справочник пользователей бота в памяти: по telegram_id, username и роли."""
+
+import os
+
+from utils.db_async import db_call
+from utils.ttl_cache import RefreshingValue
+
+USER_CACHE_TTL = int(os.environ.get("USER_CACHE_TTL", "60"))
+
+
+class UserDirectory:
+    """Таблица 'users' целиком в памяти процесса.
+
+    Сотрудников немного, поэтому вся таблица читается одним запросом и
+    раскладывается по индексам. Данные живут USER_CACHE_TTL секунд и затем
+    обновляются в фоне; после изменений пользователей ботом нужно вызвать
+    invalidate(), тогда следующий запрос перечитает таблицу.
+
+    Методы асинхронные: синхронная загрузка (первая и после invalidate)
+    выполняется в пуле потоков базы, а в обычном случае ответ берётся из
+    памяти без обращения к пулу.
+    """
+
+    def __init__(self, client, ttl=USER_CACHE_TTL):
+        self._client = client
+        # По этим данным проверяются права: после invalidate() старые не отдаём
+        self._snapshot = RefreshingValue(
+            self._load, ttl, default=([], {}, {}, {}), name="users", stale_on_error=False
+        )
+
+    def _load(self):
+        res = self._client.table("users").select("*").execute()
+        users = list(res.data or [])
+        by_id, by_username, by_role = {}, {}, {}
+        for user in users:
+            by_id[user.get("telegram_id")] = user
+            if user.get("username"):
+                by_username[user["username"]] = user
+            by_role.setdefault(user.get("role"), []).append(user)
+        return users, by_id, by_username, by_role
+
+    async def _get_snapshot(self):
+        if self._snapshot.ready():
+            return self._snapshot.get()
+        return await db_call(self._snapshot.get)
+
+    async def all(self):
+        """Все пользователи"""
+        return (await self._get_snapshot())[0]
+
+    async def get(self, telegram_id):
+        """Пользователь по telegram_id или None"""
+        return (await self._get_snapshot())[1].get(telegram_id)
+
+    async def by_username(self, username):
+        """Пользователь по username или None"""
+        return (await self._get_snapshot())[2].get(username)
+
+    async def with_roles(self, *roles):
+        """Пользователи с одной из ролей"""
+        by_role = (await self._get_snapshot())[3]
+        return [user for role in roles for user in by_role.get(role, [])]
+
+    def invalidate(self):
+        """Сбросить кэш после изменения пользователей"""
+        self._snapshot.invalidate()
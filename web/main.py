@@ -4,15 +4,21 @@ import io
 import time
 import json
 import base64
-import hmac
 import hashlib
+import hmac
+import threading
 from datetime import datetime, timezone, timedelta
-from flask import Flask, request, render_template_string, send_file, session, redirect, url_for
+from flask import Flask, Response, jsonify, request, send_file, session, redirect, url_for
 from dotenv import load_dotenv
-import qrcode
 from pathlib import Path
 import utils.httpx_proxy_patch  # noqa: F401
 from supabase import create_client, Client
+from utils.branch_catalog import BRANCH_CACHE_TTL, BranchCatalog
+from utils.ttl_cache import RefreshingValue
+from utils import qr_payload
+from utils.qr_payload import QR_TIME_WINDOW
+from web.qr_cache import QRWindowCache
+from web import qr_render
 
 # Московское время (UTC+3)
 MOSCOW_TZ = timezone(timedelta(hours=3))
@@ -31,50 +37,611 @@ load_dotenv()
 SUPABASE_URL = os.environ.get("NEXT_PUBLIC_SUPABASE_URL")
 SUPABASE_KEY = os.environ.get("NEXT_PUBLIC_SUPABASE_ANON_KEY")
 QR_SECRET = os.environ.get("QR_SECRET")
+# Версия формата данных QR: 2 — компактный, 1 — прежний base64(JSON)
+QR_PAYLOAD_VERSION = int(os.environ.get("QR_PAYLOAD_VERSION", "2"))
+# 1 — киоск получает подписанные ссылки на картинки QR без сессии,
+# их может кэшировать обратный прокси (Caddy) перед gunicorn
+QR_SIGNED_IMAGE_URLS = int(os.environ.get("QR_SIGNED_IMAGE_URLS", "0"))
 
 if not (SUPABASE_URL and SUPABASE_KEY and QR_SECRET):
     raise Exception("Укажите все переменные окружения: NEXT_PUBLIC_SUPABASE_URL, NEXT_PUBLIC_SUPABASE_ANON_KEY, QR_SECRET")
 
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Сброс кэша филиалов действует только в своём процессе (у gunicorn их
+# несколько, у бота — свой), поэтому в web справочник живёт недолго:
+# правки филиалов видны всем воркерам не позже чем через этот срок
+WEB_BRANCH_CACHE_TTL = int(os.environ.get("WEB_BRANCH_CACHE_TTL", "60"))
+branch_catalog = BranchCatalog(supabase, ttl=WEB_BRANCH_CACHE_TTL)
+
+# Максимальная длительность одного SSE-соединения киоска (потом браузер переподключается)
+QR_STREAM_MAX_SECONDS = int(os.environ.get("QR_STREAM_MAX_SECONDS", "300"))
+# SSE-соединение всё время держит поток gunicorn (gthread), поэтому их число
+# на процесс ограничено: остальные потоки остаются для /health, /qr_image и
+# страниц. Сверх лимита /qr_stream отвечает 503, и киоск переходит на batch.
+# При -w 2 --threads 8 это 8 киосков в режиме push на контейнер
+QR_STREAM_MAX_CONNECTIONS = int(os.environ.get("QR_STREAM_MAX_CONNECTIONS", "4"))
+qr_stream_slots = threading.BoundedSemaphore(QR_STREAM_MAX_CONNECTIONS)
+# Интервал пустых сообщений, чтобы прокси не закрывал соединение
+QR_STREAM_HEARTBEAT = 15
+
+# Сколько окон вперёд киоск может получить одной пачкой (/qr_batch)
+QR_BATCH_DEFAULT = 10
+QR_BATCH_MAX = 20
+
+# Готовые изображения QR-кодов по (branch_id, time_window), отдельно для каждого движка
+qr_image_caches = {
+    engine: QRWindowCache(max_entries=int(os.environ.get("QR_IMAGE_CACHE_SIZE", "64")))
+    for engine in qr_render.ENGINES
+}
+# Матрицы модулей QR для отрисовки на стороне киоска (/qr_matrix)
+qr_matrix_cache = QRWindowCache(max_entries=int(os.environ.get("QR_IMAGE_CACHE_SIZE", "64")))
+
+PHILOSOPHY_CACHE_TTL = int(os.environ.get("PHILOSOPHY_CACHE_TTL", "600"))
+
+# Пункты философии клиники для страницы /qr
+def load_philosophy():
+    res = supabase.table("philosophy").select("text").order("id", desc=False).execute()
+    if res.data:
+        return [row["text"] for row in res.data]
+    return ["Философия клиники «Гирудомед»: нет данных."]
+
+philosophy_cache = RefreshingValue(
+    load_philosophy, PHILOSOPHY_CACHE_TTL,
+    default=["Философия клиники «Гирудомед»: ошибка загрузки из Supabase."], name="philosophy",
+)
+
+# Готовые HTML-оболочки /qr: (branch_id, mode, render, engine) → (философия, название, html, etag)
+qr_shell_cache = {}
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("FLASK_SECRET_KEY", "your-secret-key-here-change-in-production")
 
+# Шаблоны страниц компилируются один раз при импорте
+LOGIN_TEMPLATE = app.jinja_env.from_string("""
+<!doctype html>
+<html>
+<head>
+    <title>Авторизация</title>
+    <meta charset="utf-8">
+    <style>
+        @import url('https://fonts.googleapis.com/css2?family=Montserrat:wght@400;500;600;700&display=swap');
+        body { font-family: 'Montserrat', Arial, sans-serif; background: #f4f4f4; padding: 2em; }
+        .container { background: #fff; padding: 2em; max-width: 400px; margin: auto; border-radius: 16px; box-shadow: 0 0 10px #bbb; }
+        input, button { padding: 0.6em 1em; border-radius: 8px; border: 1px solid #ccc; margin-bottom: 1em; width: 100%; font-family: 'Montserrat', Arial, sans-serif; }
+        .error { color: #dc3545; margin-bottom: 1em; }
+    </style>
+</head>
+<body>
+    <div class="container">
+        <h2>Авторизация</h2>
+        {% if error %}
+        <div class="error">Неверный логин или пароль</div>
+        {% endif %}
+        <form method="post">
+            <input type="text" name="username" placeholder="Логин" required>
+            <input type="password" name="password" placeholder="Пароль" required>
+            <button type="submit">Войти</button>
+        </form>
+    </div>
+</body>
+</html>
+""")
+
+INDEX_TEMPLATE = app.jinja_env.from_string("""
+<!doctype html>
+<html>
+<head>
+    <title>QR для сотрудников</title>
+    <meta charset="utf-8">
+    <style>
+        @import url('https://fonts.googleapis.com/css2?family=Montserrat:wght@400;500;600;700&display=swap');
+        body { font-family: 'Montserrat', Arial, sans-serif; background: #f4f4f4; padding: 2em; }
+        .container { background: #fff; padding: 2em; max-width: 400px; margin: auto; border-radius: 16px; box-shadow: 0 0 10px #bbb; }
+        select, button { padding: 0.6em 1em; border-radius: 8px; border: 1px solid #ccc; margin-bottom: 1em; width: 100%; font-family: 'Montserrat', Arial, sans-serif; }
+        img { display: block; margin: 1.5em auto; }
+    </style>
+</head>
+<body>
+    <div class="container">
+        <h2>Генерация QR-кода</h2>
+        <form method="get" action="/qr">
+            <label>Выберите филиал:</label>
+            <select name="branch_id" required>
+                {% for branch in branches %}
+                    <option value="{{branch['id']}}">{{branch['name']}}</option>
+                {% endfor %}
+            </select>
+            <button type="submit">Показать QR</button>
+        </form>
+        <div style="margin-top: 1em; text-align: center;">
+            <a href="/logout" style="color: #666; text-decoration: none; font-size: 0.9em;">Выйти</a>
+        </div>
+    </div>
+</body>
+</html>
+""")
+
+QR_TEMPLATE = app.jinja_env.from_string("""
+<!doctype html>
+<html lang="ru">
+<head>
+    <meta charset="utf-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1, maximum-scale=1, user-scalable=no">
+    <title>QR-код для {{branch['name']}}</title>
+    <style>
+        @import url('https://fonts.googleapis.com/css2?family=Montserrat:wght@400;500;600;700&display=swap');
+        html,body {
+            height: 100%;
+            margin: 0;
+            padding: 0;
+            font-family: 'Montserrat', 'Inter', 'Segoe UI', Arial, sans-serif;
+            background: linear-gradient(135deg, #0e1f13 0%, #1a3a24 100%);
+            color: #eaf7ef;
+            min-height: 100vh;
+        }
+        body {
+            display: flex;
+            flex-direction: column;
+            min-height: 100vh;
+        }
+        .container {
+            background: rgba(24, 44, 32, 0.97);
+            border-radius: 2.2rem;
+            box-shadow: 0 8px 40px 0 rgba(34, 139, 34, 0.18), 0 1.5px 8px 0 rgba(0,0,0,0.10);
+            max-width: 630px;
+            margin: auto;
+            padding: 2.2rem 1.2rem 1.2rem 1.2rem;
+            display: flex;
+            flex-direction: column;
+            align-items: center;
+            gap: 1.2rem;
+            min-height: 92vh;
+            justify-content: center;
+        }
+        .philosophy-title {
+            font-size: 1.15rem;
+            font-weight: 700;
+            color: #b6f5c6;
+            letter-spacing: 0.5px;
+            margin-bottom: 0.3rem;
+            text-shadow: 0 1px 8px #1e4d2b44;
+        }
+        .philosophy-block {
+            font-size: 1.01em;
+            font-weight: 500;
+            line-height: 1.45;
+            color: #1a3a24;
+            background: #ffffff;
+            border: 1.5px solid #4ecb7a;
+            border-radius: 1.1rem;
+            margin-bottom: 0.2rem;
+            padding: 1rem 0.8rem;
+            width: 100%;
+            max-width: 510px;
+            box-sizing: border-box;
+            box-shadow: 0 2px 12px rgba(76, 203, 122, 0.10);
+            display: flex;
+            align-items: center;
+            justify-content: center;
+            text-align: center;
+            overflow-wrap: break-word;
+            word-break: break-word;
+            hyphens: auto;
+            white-space: pre-wrap;
+            transition: all 0.4s ease-in-out;
+            min-height: auto;
+        }
+        h2 {
+            font-size: 1.13rem;
+            font-weight: 600;
+            color: #eaf7ef;
+            margin: 0.3rem 0 0.5rem 0;
+            letter-spacing: 0.01em;
+        }
+        .qr-box {
+            background: #fff;
+            border-radius: 1.2rem;
+            box-shadow: 0 2px 16px rgba(34, 139, 34, 0.10);
+            padding: 0.7rem;
+            display: flex;
+            justify-content: center;
+            align-items: center;
+            margin-bottom: 0.2rem;
+            transition: transform 0.4s ease-in-out;
+        }
+        .qr-box img, .qr-box canvas {
+            image-rendering: pixelated;
+            width: 60vw;
+            max-width: 260px;
+            min-width: 120px;
+            height: auto;
+            display: block;
+        }
+        .timer {
+            font-size: 1.01rem;
+            color: #b6f5c6;
+            margin: 0.5rem 0 0.1rem 0;
+            letter-spacing: 0.02em;
+        }
+        .expired { color: #dc3545; }
+        .back-link {
+            display: inline-block;
+            margin-top: 0.7rem;
+            color: #b6f5c6;
+            text-decoration: none;
+            font-weight: 500;
+            font-size: 1.5rem;
+            transition: color 0.2s;
+        }
+        .back-link:hover { color: #4ecb7a; }
+        @media (max-width: 600px) {
+            .container { padding: 0.7rem 0.2rem; min-height: 99vh; }
+            .philosophy-block { font-size: 0.98em; }
+            .qr-box img, .qr-box canvas { width: 90vw; max-width: 98vw; }
+        }
+    </style>
+</head>
+<body>
+    <div class="container">
+        <div class="philosophy-title">Философия клиники «Гирудомед»</div>
+        <div class="philosophy-block" id="philosophy-text"></div>
+        <h2>Филиал: {{branch['name']}}</h2>
+        <div class="qr-box">
+            {% if render == 'canvas' %}
+            <canvas id="qr-canvas" aria-label="QR-код"></canvas>
+            {% else %}
+            <img id="qr-image" src="/qr_image?branch_id={{branch['id']}}&engine={{engine}}" alt="QR-код" />
+            {% endif %}
+        </div>
+        <div class="timer">
+            <span id="timer">Обновление через: <span id="countdown">30</span> сек</span>
+        </div>
+        <div style="font-size:0.97rem;color:#b6f5c6;margin-top:0.1rem;">QR-код действителен 1 минуту</div>
+        <a class="back-link" href="/">←</a>
+    </div>
+    <script>
+        // Философия из Python
+        const philosophyPoints = {{ philosophy_points|tojson }};
+        let philosophyBlock = document.getElementById('philosophy-text');
+        
+        function getRandomPhilosophy() {
+            const randomIndex = Math.floor(Math.random() * philosophyPoints.length);
+            const pointNumber = randomIndex + 1;
+            
+            // Плавная смена текста с адаптацией размера
+            philosophyBlock.style.opacity = '0.6';
+            philosophyBlock.style.transform = 'scale(0.98)';
+            
+            setTimeout(() => {
+                philosophyBlock.textContent = `${pointNumber}. ${philosophyPoints[randomIndex]}`;
+                
+                // Возвращаем нормальное состояние
+                philosophyBlock.style.opacity = '1';
+                philosophyBlock.style.transform = 'scale(1)';
+            }, 200);
+        }
+        
+        getRandomPhilosophy();
+        setInterval(getRandomPhilosophy, 15000);
+
+        let timerElement = document.getElementById('countdown');
+        let qrImage = document.getElementById('qr-image');
+        let qrCanvas = document.getElementById('qr-canvas');
+        let branchId = {{branch['id']}};
+        let clockOffset = 0;    // серверное время минус локальное, мс
+        let windowEnds = null;  // конец текущего окна по часам сервера, мс
+        const mode = {{ mode|tojson }};
+        const windowSeconds = {{ window_seconds }};
+        const batchSize = {{ batch_size }};
+        const render = {{ render|tojson }};
+        const engine = {{ engine|tojson }};
+        
+        // Отрисовка матрицы модулей на canvas (1 бит на модуль, построчно)
+        function drawMatrix(matrix) {
+            const quiet = 4;
+            const modules = matrix.size + quiet * 2;
+            const scale = Math.max(1, Math.floor(520 / modules));
+            qrCanvas.width = qrCanvas.height = modules * scale;
+            const ctx = qrCanvas.getContext('2d');
+            ctx.fillStyle = '#fff';
+            ctx.fillRect(0, 0, qrCanvas.width, qrCanvas.height);
+            ctx.fillStyle = '#000';
+            const bits = atob(matrix.bits);
+            for (let y = 0; y < matrix.size; y++) {
+                for (let x = 0; x < matrix.size; x++) {
+                    const i = y * matrix.size + x;
+                    if (bits.charCodeAt(i >> 3) & (0x80 >> (i & 7))) {
+                        ctx.fillRect((x + quiet) * scale, (y + quiet) * scale, scale, scale);
+                    }
+                }
+            }
+        }
+        
+        function loadMatrix(url) {
+            fetch(url, {credentials: 'same-origin'})
+                .then((r) => r.json())
+                .then(drawMatrix)
+                .catch(() => {});
+        }
+        
+        // Новый QR приходит от сервера ровно на смене окна
+        function showWindow(msg) {
+            clockOffset = msg.server_time - Date.now();
+            windowEnds = msg.window_ends;
+            if (render === 'canvas') {
+                loadMatrix(msg.matrix_url);
+            } else {
+                qrImage.src = msg.image_url;
+            }
+            updateTimer();
+        }
+        
+        function updateTimer() {
+            if (windowEnds === null) return;
+            const left = Math.ceil((windowEnds - (Date.now() + clockOffset)) / 1000);
+            timerElement.textContent = Math.max(0, left);
+        }
+        
+        // Режим batch: коды на несколько окон вперёд, смена по локальному расписанию
+        let batch = [];
+        let batchLoading = false;
+        let shownWindow = null;
+        
+        function serverWindow() {
+            return Math.floor((Date.now() + clockOffset) / 1000 / windowSeconds);
+        }
+        
+        function loadBatch() {
+            if (batchLoading) return;
+            batchLoading = true;
+            const format = render === 'canvas' ? 'matrix' : engine;
+            fetch('/qr_batch?branch_id=' + branchId + '&count=' + batchSize + '&format=' + format, {credentials: 'same-origin'})
+                .then((r) => r.json())
+                .then((data) => {
+                    clockOffset = data.server_time - Date.now();
+                    const known = new Set(batch.map((item) => item.window));
+                    batch = batch.concat(data.items.filter((item) => !known.has(item.window)));
+                    batch.sort((a, b) => a.window - b.window);
+                    rotateBatch();
+                })
+                .catch(() => {})  // сеть моргнула — работаем на оставшихся кодах
+                .finally(() => { batchLoading = false; });
+        }
+        
+        function rotateBatch() {
+            const current = serverWindow();
+            batch = batch.filter((item) => item.window >= current);
+            const item = batch.find((i) => i.window === current);
+            if (item && shownWindow !== current) {
+                shownWindow = current;
+                if (render === 'canvas') {
+                    drawMatrix(item.matrix);
+                } else {
+                    qrImage.src = item.image;
+                }
+                windowEnds = (current + 1) * windowSeconds * 1000;
+            }
+            if (batch.length <= batchSize / 2) loadBatch();
+            updateTimer();
+        }
+        
+        function startBatch() {
+            loadBatch();
+            setInterval(rotateBatch, 1000);
+        }
+        
+        if (mode === 'batch') {
+            startBatch();
+        } else if (window.EventSource) {
+            const source = new EventSource('/qr_stream?branch_id=' + branchId + '&engine=' + engine);
+            source.addEventListener('qr', (e) => showWindow(JSON.parse(e.data)));
+            source.onerror = () => {
+                // Закрыто насовсем (503 — заняты все слоты SSE): коды пачкой
+                if (source.readyState === EventSource.CLOSED) startBatch();
+            };
+        } else {
+            // Старые браузеры без SSE — запрос по номеру окна, повторы отдаёт кэш браузера
+            const poll = () => {
+                const current = serverWindow();
+                if (current === shownWindow) return;
+                shownWindow = current;
+                if (render === 'canvas') {
+                    loadMatrix('/qr_matrix?branch_id=' + branchId + '&w=' + current);
+                } else {
+                    qrImage.src = '/qr_image?branch_id=' + branchId + '&engine=' + engine + '&w=' + current;
+                }
+                windowEnds = (current + 1) * windowSeconds * 1000;
+            };
+            poll();
+            setInterval(poll, 1000);
+        }
+        setInterval(updateTimer, 1000);
+    </script>
+</body>
+</html>
+""")
+
+SCANNER_TEMPLATE = app.jinja_env.from_string("""
+<!doctype html>
+<html lang="ru">
+<head>
+    <meta charset="utf-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1, maximum-scale=1, user-scalable=no">
+    <title>Сканер QR</title>
+    <script src="https://telegram.org/js/telegram-web-app.js"></script>
+    <style>
+        body { margin: 0; height: 100vh; overflow: hidden; background: #000; color: #fff; font-family: Arial, sans-serif; }
+        video { width: 100%; height: 100%; object-fit: cover; }
+        .frame { position: absolute; top: 50%; left: 50%; width: 65vmin; height: 65vmin; transform: translate(-50%, -50%);
+                 border: 3px solid rgba(255, 255, 255, 0.85); border-radius: 16px; box-shadow: 0 0 0 100vmax rgba(0, 0, 0, 0.45); }
+        .status { position: absolute; left: 0; right: 0; bottom: 2.5em; padding: 0 1.5em; text-align: center; font-size: 1.05em; }
+    </style>
+</head>
+<body>
+    <video id="video" playsinline muted></video>
+    <div class="frame"></div>
+    <div class="status" id="status">Наведите камеру на QR-код на экране терминала</div>
+    <canvas id="canvas" hidden></canvas>
+    <script>
+        const qrPrefix = {{ qr_prefix|tojson }};
+        const jsqrUrl = {{ jsqr_url|tojson }};
+        const jsqrIntegrity = {{ jsqr_integrity|tojson }};
+        const scanInterval = 150;  // мс между попытками распознавания
+        const scanSide = 640;      // jsQR: кадр уменьшается до этой стороны
+        const tg = window.Telegram && window.Telegram.WebApp;
+        const video = document.getElementById('video');
+        const statusElement = document.getElementById('status');
+        const canvas = document.getElementById('canvas');
+        const ctx = canvas.getContext('2d', {willReadFrequently: true});
+        let detectCodes = null;
+        let done = false;
+        
+        function setStatus(text) {
+            statusElement.textContent = text;
+        }
+        
+        function loadScript(src, integrity) {
+            return new Promise((resolve, reject) => {
+                const script = document.createElement('script');
+                if (integrity) {
+                    script.integrity = integrity;
+                    script.crossOrigin = 'anonymous';
+                }
+                script.src = src;
+                script.onload = resolve;
+                script.onerror = reject;
+                document.head.appendChild(script);
+            });
+        }
+        
+        // Встроенный BarcodeDetector (Chrome на Android) быстрее; jsQR — для iOS и остальных
+        async function createDetector() {
+            if ('BarcodeDetector' in window) {
+                try {
+                    const formats = await BarcodeDetector.getSupportedFormats();
+                    if (formats.includes('qr_code')) {
+                        const detector = new BarcodeDetector({formats: ['qr_code']});
+                        return async () => (await detector.detect(video)).map((code) => code.rawValue);
+                    }
+                } catch (e) {}
+            }
+            await loadScript(jsqrUrl, jsqrIntegrity);
+            return async () => {
+                const scale = Math.min(1, scanSide / Math.max(video.videoWidth, video.videoHeight));
+                canvas.width = Math.round(video.videoWidth * scale);
+                canvas.height = Math.round(video.videoHeight * scale);
+                ctx.drawImage(video, 0, 0, canvas.width, canvas.height);
+                const image = ctx.getImageData(0, 0, canvas.width, canvas.height);
+                const code = jsQR(image.data, image.width, image.height, {inversionAttempts: 'dontInvert'});
+                return code ? [code.data] : [];
+            };
+        }
+        
+        // Текст кода уходит боту как web_app_data; подпись и срок проверяет бот
+        function finish(text) {
+            done = true;
+            video.srcObject.getTracks().forEach((track) => track.stop());
+            if (tg && tg.HapticFeedback) tg.HapticFeedback.notificationOccurred('success');
+            if (tg && tg.initData) {
+                setStatus('✅ QR-код считан, отправляю в бот...');
+                tg.sendData(text);  // закрывает Mini App
+            } else {
+                setStatus('Откройте сканер кнопкой в боте');
+            }
+        }
+        
+        async function scan() {
+            if (done) return;
+            if (video.readyState >= video.HAVE_ENOUGH_DATA) {
+                try {
+                    const values = await detectCodes();
+                    const ours = values.find((value) => value.startsWith(qrPrefix));
+                    if (ours) return finish(ours);
+                    if (values.length) setStatus('Это не QR-код терминала учёта времени');
+                } catch (e) {
+                    console.error(e);
+                }
+            }
+            setTimeout(scan, scanInterval);
+        }
+        
+        async function start() {
+            if (tg) {
+                tg.ready();
+                tg.expand();
+            }
+            if (!navigator.mediaDevices || !navigator.mediaDevices.getUserMedia) {
+                setStatus('Камера недоступна. Отправьте боту фото QR-кода.');
+                return;
+            }
+            try {
+                video.srcObject = await navigator.mediaDevices.getUserMedia({
+                    video: {facingMode: 'environment', width: {ideal: 1280}, height: {ideal: 720}},
+                    audio: false,
+                });
+                await video.play();
+                detectCodes = await createDetector();
+            } catch (e) {
+                setStatus('Нет доступа к камере. Разрешите доступ или отправьте боту фото QR-кода.');
+                return;
+            }
+            scan();
+        }
+        
+        start();
+    </script>
+</body>
+</html>
+""")
+
+# Резервный декодер для браузеров без BarcodeDetector (iOS, десктоп).
+# Отдаётся со своего домена: закреплённую версию кладёт в web/static/vendor
+# сборка образа (Dockerfile). Внешний JSQR_URL (CDN) подключается только
+# с SRI-хешем в JSQR_INTEGRITY ("sha384-...") — страница работает с камерой
+# и отправляет данные боту
+JSQR_DEFAULT_URL = "/static/vendor/jsQR.js"
+JSQR_URL = os.environ.get("JSQR_URL", JSQR_DEFAULT_URL)
+JSQR_INTEGRITY = os.environ.get("JSQR_INTEGRITY", "")
+if JSQR_URL.startswith(("http://", "https://", "//")) and not JSQR_INTEGRITY:
+    print(f"JSQR_URL {JSQR_URL} задан без JSQR_INTEGRITY, используем {JSQR_DEFAULT_URL}", flush=True)
+    JSQR_URL = JSQR_DEFAULT_URL
+# Страница сканера одинакова для всех, её можно кэшировать
+SCANNER_MAX_AGE = 3600
+
+def render_page(template, **context):
+    """Отрендерить заранее скомпилированный шаблон с контекстом Flask"""
+    app.update_template_context(context)
+    return template.render(context)
+
 @app.route('/health')
 def health():
     return "200", 200
 
-# Получение списка филиалов из таблицы 'branches' через Supabase API
+# Получение списка филиалов из таблицы 'branches' (через общий кэш)
 def get_branches():
-    try:
-        res = supabase.table("branches").select("*").execute()
-        if res.data:
-            print(f"Получено филиалов: {len(res.data)}", flush=True)
-            return res.data
-        print("Филиалы не найдены", flush=True)
-        return []
-    except Exception as e:
-        import traceback; traceback.print_exc()
-        print("Ошибка при получении филиалов через Supabase API:", e, flush=True)
-        return []
+    return branch_catalog.all()
 
 # Генерация подписи для QR (HMAC-SHA256)
 def generate_signature(branch_id, time_window):
     """Генерация подписи для QR-кода"""
     try:
-        msg = f"{branch_id}:{time_window}".encode()
-        secret = QR_SECRET.encode()
-        return hmac.new(secret, msg, hashlib.sha256).hexdigest()
+        return qr_payload.sign_v1(QR_SECRET, branch_id, time_window)
     except Exception as e:
         print(f"Ошибка генерации подписи: {e}", flush=True)
         return None
 
-# Генерация base64-кодированной строки для QR
-def generate_qr_payload(branch_id, branch_name):
+# Генерация строки данных для QR (без префикса /qr_)
+def generate_qr_payload(branch_id, branch_name, timestamp=None):
     """Генерация данных для QR-кода с улучшенной логикой времени"""
     try:
-        timestamp = get_moscow_timestamp()
-        time_window = timestamp // 30  # Окно 30 секунд
+        if timestamp is None:
+            timestamp = get_moscow_timestamp()
+        time_window = timestamp // QR_TIME_WINDOW  # Окно 30 секунд
+
+        if QR_PAYLOAD_VERSION >= 2:
+            # Компактный формат: название филиала бот берёт из своего справочника
+            return qr_payload.encode_v2(QR_SECRET, branch_id, time_window)
+
         expires = timestamp + 120  # Увеличиваем время жизни до 2 минут
         signature = generate_signature(branch_id, time_window)
         
@@ -101,6 +668,71 @@ def generate_qr_payload(branch_id, branch_name):
         print(f"Ошибка генерации QR-кода: {e}", flush=True)
         return None
 
+def get_window_arg():
+    """Окно из параметра w (по умолчанию текущее); None, если окно вне допустимого диапазона.
+
+    Разрешены предыдущее окно (на случай расхождения часов киоска) и окна
+    вперёд в пределах QR_BATCH_MAX — так же, как для /qr_batch.
+    """
+    current_window = get_moscow_timestamp() // QR_TIME_WINDOW
+    time_window = request.args.get("w", current_window, type=int)
+    if not current_window - 1 <= time_window <= current_window + QR_BATCH_MAX:
+        return None
+    return time_window
+
+def window_cache_headers(response, etag, time_window, public=False):
+    """ETag и срок кэширования до конца окна: содержимое окна не меняется"""
+    seconds_left = (time_window + 1) * QR_TIME_WINDOW - get_moscow_timestamp()
+    response.set_etag(etag)
+    scope = "public" if public else "private"
+    response.headers["Cache-Control"] = f"{scope}, max-age={max(0, seconds_left)}"
+    return response
+
+def not_modified(etag, time_window, public=False):
+    """Ответ 304, если у браузера уже есть это окно (без рендера)"""
+    if etag in request.if_none_match:
+        return window_cache_headers(Response(status=304), etag, time_window, public)
+    return None
+
+def cached_window_render(cache, branch_id, time_window, render):
+    """Рендер окна через кэш; далёкие окна рендерятся мимо кэша,
+    чтобы не вытеснять из него текущее окно"""
+    current_window = get_moscow_timestamp() // QR_TIME_WINDOW
+    if time_window > current_window + 1:
+        return render()
+    return cache.get_or_render(branch_id, time_window, render)
+
+def window_image_response(branch_id, time_window, engine, public=False):
+    """Картинка QR окна с ETag и сроком кэширования до конца окна"""
+    etag = f"{engine}{QR_PAYLOAD_VERSION}-{branch_id}-{time_window}"
+    cached = not_modified(etag, time_window, public)
+    if cached:
+        return cached
+
+    cache = qr_image_caches[engine]
+    image = cache.get(branch_id, time_window)
+    if image is None:
+        branch = branch_catalog.get(branch_id)
+        if not branch:
+            return "Филиал не найден", 404
+
+        def render():
+            qr_data = generate_qr_payload(branch_id, branch["name"], time_window * QR_TIME_WINDOW)
+            if not qr_data:
+                return None
+            return qr_render.render_image(f"/qr_{qr_data}", engine)[0]
+
+        image = cached_window_render(cache, branch_id, time_window, render)
+        if image is None:
+            return "Ошибка генерации QR-кода", 500
+    response = Response(image, mimetype=qr_render.ENGINES[engine][1])
+    return window_cache_headers(response, etag, time_window, public)
+
+def get_engine_arg():
+    """Движок рендера из параметра engine (png или svg)"""
+    engine = request.args.get("engine", qr_render.DEFAULT_ENGINE)
+    return engine if engine in qr_render.ENGINES else None
+
 @app.route("/login", methods=["GET", "POST"])
 def login():
     if request.method == "POST":
@@ -111,63 +743,9 @@ def login():
             session["authenticated"] = True
             return redirect(url_for("index"))
         else:
-            return render_template_string(
-                """
-                <!doctype html>
-                <html>
-                <head>
-                    <title>Авторизация</title>
-                    <meta charset="utf-8">
-                    <style>
-                        @import url('https://fonts.googleapis.com/css2?family=Montserrat:wght@400;500;600;700&display=swap');
-                        body { font-family: 'Montserrat', Arial, sans-serif; background: #f4f4f4; padding: 2em; }
-                        .container { background: #fff; padding: 2em; max-width: 400px; margin: auto; border-radius: 16px; box-shadow: 0 0 10px #bbb; }
-                        input, button { padding: 0.6em 1em; border-radius: 8px; border: 1px solid #ccc; margin-bottom: 1em; width: 100%; font-family: 'Montserrat', Arial, sans-serif; }
-                        .error { color: #dc3545; margin-bottom: 1em; }
-                    </style>
-                </head>
-                <body>
-                    <div class="container">
-                        <h2>Авторизация</h2>
-                        <div class="error">Неверный логин или пароль</div>
-                        <form method="post">
-                            <input type="text" name="username" placeholder="Логин" required>
-                            <input type="password" name="password" placeholder="Пароль" required>
-                            <button type="submit">Войти</button>
-                        </form>
-                    </div>
-                </body>
-                </html>
-                """
-            )
+            return render_page(LOGIN_TEMPLATE, error=True)
     
-    return render_template_string(
-        """
-        <!doctype html>
-        <html>
-        <head>
-            <title>Авторизация</title>
-            <meta charset="utf-8">
-            <style>
-                @import url('https://fonts.googleapis.com/css2?family=Montserrat:wght@400;500;600;700&display=swap');
-                body { font-family: 'Montserrat', Arial, sans-serif; background: #f4f4f4; padding: 2em; }
-                .container { background: #fff; padding: 2em; max-width: 400px; margin: auto; border-radius: 16px; box-shadow: 0 0 10px #bbb; }
-                input, button { padding: 0.6em 1em; border-radius: 8px; border: 1px solid #ccc; margin-bottom: 1em; width: 100%; font-family: 'Montserrat', Arial, sans-serif; }
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <h2>Авторизация</h2>
-                <form method="post">
-                    <input type="text" name="username" placeholder="Логин" required>
-                    <input type="password" name="password" placeholder="Пароль" required>
-                    <button type="submit">Войти</button>
-                </form>
-            </div>
-        </body>
-        </html>
-        """
-    )
+    return render_page(LOGIN_TEMPLATE)
 
 @app.route("/logout")
 def logout():
@@ -179,6 +757,25 @@ def require_auth():
         return redirect(url_for("login"))
     return None
 
+@app.route("/branches/refresh")
+def refresh_branches():
+    """Сбросить кэш филиалов после изменений в Supabase.
+
+    Сбрасывается только кэш воркера gunicorn, принявшего запрос. Остальные
+    воркеры обновятся в фоне за WEB_BRANCH_CACHE_TTL секунд, бот — за
+    BRANCH_CACHE_TTL. Это же сообщается в ответе.
+    """
+    auth_check = require_auth()
+    if auth_check:
+        return auth_check
+    branch_catalog.invalidate()
+    return jsonify({
+        "invalidated": "process",
+        "pid": os.getpid(),
+        "other_workers_refresh_within": WEB_BRANCH_CACHE_TTL,
+        "bot_refresh_within": BRANCH_CACHE_TTL,
+    })
+
 @app.route("/", methods=["GET"])
 def index():
     auth_check = require_auth()
@@ -186,41 +783,7 @@ def index():
         return auth_check
     
     branches = get_branches()
-    return render_template_string(
-        """
-        <!doctype html>
-        <html>
-        <head>
-            <title>QR для сотрудников</title>
-            <meta charset="utf-8">
-            <style>
-                @import url('https://fonts.googleapis.com/css2?family=Montserrat:wght@400;500;600;700&display=swap');
-                body { font-family: 'Montserrat', Arial, sans-serif; background: #f4f4f4; padding: 2em; }
-                .container { background: #fff; padding: 2em; max-width: 400px; margin: auto; border-radius: 16px; box-shadow: 0 0 10px #bbb; }
-                select, button { padding: 0.6em 1em; border-radius: 8px; border: 1px solid #ccc; margin-bottom: 1em; width: 100%; font-family: 'Montserrat', Arial, sans-serif; }
-                img { display: block; margin: 1.5em auto; }
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <h2>Генерация QR-кода</h2>
-                <form method="get" action="/qr">
-                    <label>Выберите филиал:</label>
-                    <select name="branch_id" required>
-                        {% for branch in branches %}
-                            <option value="{{branch['id']}}">{{branch['name']}}</option>
-                        {% endfor %}
-                    </select>
-                    <button type="submit">Показать QR</button>
-                </form>
-                <div style="margin-top: 1em; text-align: center;">
-                    <a href="/logout" style="color: #666; text-decoration: none; font-size: 0.9em;">Выйти</a>
-                </div>
-            </div>
-        </body>
-        </html>
-        """, branches=branches
-    )
+    return render_page(INDEX_TEMPLATE, branches=branches)
 
 @app.route("/qr", methods=["GET"])
 def qr():
@@ -231,215 +794,180 @@ def qr():
     branch_id = request.args.get("branch_id", type=int)
     if not branch_id:
         return "Не выбран филиал", 400
-    branches = get_branches()
-    branch = next((b for b in branches if b["id"] == branch_id), None)
+    branch = branch_catalog.get(branch_id)
     if not branch:
         return "Филиал не найден", 404
-    qr_data = generate_qr_payload(branch_id, branch["name"])
-    qr_full = f"/qr_{qr_data}"
+    # batch — киоск сам меняет заранее подписанные коды (не держит соединение),
+    # push — новый QR по SSE, пока есть свободные слоты (QR_STREAM_MAX_CONNECTIONS)
+    mode = "push" if request.args.get("mode") == "push" else "batch"
+    # img — PNG с сервера, canvas — браузер рисует QR по матрице модулей
+    render = "canvas" if request.args.get("render") == "canvas" else "img"
+    # Движок картинки для режима img: png (1-битный профиль киоска) или svg
+    engine = get_engine_arg() or qr_render.DEFAULT_ENGINE
 
-    # Получаем все пункты философии из Supabase через API
-    philosophy_points = []
-    try:
-        res = supabase.table("philosophy").select("text").order("id", desc=False).execute()
-        if res.data:
-            philosophy_points = [row["text"] for row in res.data]
+    philosophy_points = philosophy_cache.get()
+    key = (branch_id, mode, render, engine)
+    shell = qr_shell_cache.get(key)
+    # Оболочку перерисовываем, только если сменились философия или название филиала
+    if not shell or shell[0] is not philosophy_points or shell[1] != branch["name"]:
+        body = render_page(
+            QR_TEMPLATE, branch=branch, philosophy_points=philosophy_points,
+            mode=mode, render=render, engine=engine, window_seconds=QR_TIME_WINDOW, batch_size=QR_BATCH_DEFAULT
+        )
+        shell = (philosophy_points, branch["name"], body, hashlib.sha1(body.encode()).hexdigest())
+        qr_shell_cache[key] = shell
+
+    # Сам QR страница получает через /qr_batch или /qr_stream, поэтому оболочка
+    # не меняется от окна к окну и браузер может переиспользовать её по ETag
+    response = Response(shell[2], mimetype="text/html")
+    response.set_etag(shell[3])
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response.make_conditional(request)
+
+def sign_image_url(branch_id, time_window, engine, expires):
+    """Подпись ссылки на картинку QR (отдельный домен HMAC от подписи самих QR)"""
+    msg = f"qrimg:{branch_id}:{time_window}:{engine}:{expires}".encode()
+    return hmac.new(QR_SECRET.encode(), msg, hashlib.sha256).hexdigest()[:20]
+
+def signed_image_url(branch_id, time_window, engine=qr_render.DEFAULT_ENGINE):
+    """Ссылка на картинку окна, действующая до конца следующего окна"""
+    expires = (time_window + 2) * QR_TIME_WINDOW
+    signature = sign_image_url(branch_id, time_window, engine, expires)
+    return f"/qr_image/{branch_id}/{time_window}/{expires}/{signature}.{engine}"
+
+def qr_window_message(branch_id, time_window, engine=qr_render.DEFAULT_ENGINE):
+    """Данные о QR-коде окна для киоска"""
+    if QR_SIGNED_IMAGE_URLS:
+        image_url = signed_image_url(branch_id, time_window, engine)
+    else:
+        image_url = f"/qr_image?branch_id={branch_id}&engine={engine}&w={time_window}"
+    return {
+        "window": time_window,
+        "image_url": image_url,
+        "matrix_url": f"/qr_matrix?branch_id={branch_id}&w={time_window}",
+        "server_time": int(time.time() * 1000),
+        "window_ends": (time_window + 1) * QR_TIME_WINDOW * 1000,
+    }
+
+@app.route("/qr_stream")
+def qr_stream():
+    """SSE-канал: новый QR отправляется киоску в момент смены окна"""
+    auth_check = require_auth()
+    if auth_check:
+        return auth_check
+
+    branch_id = request.args.get("branch_id", type=int)
+    if not branch_id:
+        return "Не выбран филиал", 400
+    if not branch_catalog.get(branch_id):
+        return "Филиал не найден", 404
+    engine = get_engine_arg()
+    if not engine:
+        return "Неизвестный движок рендера", 400
+    if not qr_stream_slots.acquire(blocking=False):
+        # EventSource не переподключается после 503 — страница переходит на batch
+        return "Слишком много SSE-соединений", 503, {"Retry-After": str(QR_STREAM_MAX_SECONDS)}
+
+    def stream():
+        yield "retry: 2000\n\n"
+        deadline = time.monotonic() + QR_STREAM_MAX_SECONDS
+        last_window = None
+        while time.monotonic() < deadline:
+            now = time.time()
+            time_window = int(now) // QR_TIME_WINDOW
+            if time_window != last_window:
+                last_window = time_window
+                message = json.dumps(qr_window_message(branch_id, time_window, engine))
+                yield f"event: qr\ndata: {message}\n\n"
+            else:
+                yield ": ping\n\n"
+            # Спим до границы окна (с небольшим запасом), но не дольше heartbeat
+            next_window_at = (time_window + 1) * QR_TIME_WINDOW + 0.05
+            time.sleep(max(0.0, min(next_window_at - time.time(), QR_STREAM_HEARTBEAT, deadline - time.monotonic())))
+
+    response = Response(stream(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+    response.call_on_close(qr_stream_slots.release)
+    return response
+
+@app.route("/qr_batch")
+def qr_batch():
+    """Подписанные QR-коды филиала на ближайшие N окон одной пачкой"""
+    auth_check = require_auth()
+    if auth_check:
+        return auth_check
+
+    branch_id = request.args.get("branch_id", type=int)
+    if not branch_id:
+        return "Не выбран филиал", 400
+    branch = branch_catalog.get(branch_id)
+    if not branch:
+        return "Филиал не найден", 404
+    count = max(1, min(request.args.get("count", QR_BATCH_DEFAULT, type=int), QR_BATCH_MAX))
+    output = request.args.get("format", qr_render.DEFAULT_ENGINE)
+    if output != "matrix" and output not in qr_render.ENGINES:
+        return "Неизвестный формат", 400
+
+    current_window = get_moscow_timestamp() // QR_TIME_WINDOW
+    items = []
+    for time_window in range(current_window, current_window + count):
+        # Код окна подписывается так, будто сгенерирован в его начале
+        qr_data = generate_qr_payload(branch_id, branch["name"], time_window * QR_TIME_WINDOW)
+        if not qr_data:
+            return "Ошибка генерации QR-кода", 500
+        item = {"window": time_window, "payload": f"/qr_{qr_data}"}
+        if output == "matrix":
+            item["matrix"] = qr_render.render_matrix(item["payload"])
         else:
-            philosophy_points = ["Философия клиники «Гирудомед»: нет данных."]
-    except Exception as e:
-        philosophy_points = ["Философия клиники «Гирудомед»: ошибка загрузки из Supabase."]
-
-    # Генерируем картинку QR
-    qr_img = qrcode.make(qr_full)
-    img_io = io.BytesIO()
-    qr_img.save(img_io, 'PNG')
-    img_io.seek(0)
-
-    # HTML для отображения QR-кода с автообновлением и философией
-    return render_template_string(
-        """
-        <!doctype html>
-        <html lang="ru">
-        <head>
-            <meta charset="utf-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1, maximum-scale=1, user-scalable=no">
-            <title>QR-код для {{branch['name']}}</title>
-            <style>
-                @import url('https://fonts.googleapis.com/css2?family=Montserrat:wght@400;500;600;700&display=swap');
-                html,body {
-                    height: 100%;
-                    margin: 0;
-                    padding: 0;
-                    font-family: 'Montserrat', 'Inter', 'Segoe UI', Arial, sans-serif;
-                    background: linear-gradient(135deg, #0e1f13 0%, #1a3a24 100%);
-                    color: #eaf7ef;
-                    min-height: 100vh;
-                }
-                body {
-                    display: flex;
-                    flex-direction: column;
-                    min-height: 100vh;
-                }
-                .container {
-                    background: rgba(24, 44, 32, 0.97);
-                    border-radius: 2.2rem;
-                    box-shadow: 0 8px 40px 0 rgba(34, 139, 34, 0.18), 0 1.5px 8px 0 rgba(0,0,0,0.10);
-                    max-width: 630px;
-                    margin: auto;
-                    padding: 2.2rem 1.2rem 1.2rem 1.2rem;
-                    display: flex;
-                    flex-direction: column;
-                    align-items: center;
-                    gap: 1.2rem;
-                    min-height: 92vh;
-                    justify-content: center;
-                }
-                .philosophy-title {
-                    font-size: 1.15rem;
-                    font-weight: 700;
-                    color: #b6f5c6;
-                    letter-spacing: 0.5px;
-                    margin-bottom: 0.3rem;
-                    text-shadow: 0 1px 8px #1e4d2b44;
-                }
-                .philosophy-block {
-                    font-size: 1.01em;
-                    font-weight: 500;
-                    line-height: 1.45;
-                    color: #1a3a24;
-                    background: #ffffff;
-                    border: 1.5px solid #4ecb7a;
-                    border-radius: 1.1rem;
-                    margin-bottom: 0.2rem;
-                    padding: 1rem 0.8rem;
-                    width: 100%;
-                    max-width: 510px;
-                    box-sizing: border-box;
-                    box-shadow: 0 2px 12px rgba(76, 203, 122, 0.10);
-                    display: flex;
-                    align-items: center;
-                    justify-content: center;
-                    text-align: center;
-                    overflow-wrap: break-word;
-                    word-break: break-word;
-                    hyphens: auto;
-                    white-space: pre-wrap;
-                    transition: all 0.4s ease-in-out;
-                    min-height: auto;
-                }
-                h2 {
-                    font-size: 1.13rem;
-                    font-weight: 600;
-                    color: #eaf7ef;
-                    margin: 0.3rem 0 0.5rem 0;
-                    letter-spacing: 0.01em;
-                }
-                .qr-box {
-                    background: #fff;
-                    border-radius: 1.2rem;
-                    box-shadow: 0 2px 16px rgba(34, 139, 34, 0.10);
-                    padding: 0.7rem;
-                    display: flex;
-                    justify-content: center;
-                    align-items: center;
-                    margin-bottom: 0.2rem;
-                    transition: transform 0.4s ease-in-out;
-                }
-                .qr-box img {
-                    width: 60vw;
-                    max-width: 260px;
-                    min-width: 120px;
-                    height: auto;
-                    display: block;
-                }
-                .timer {
-                    font-size: 1.01rem;
-                    color: #b6f5c6;
-                    margin: 0.5rem 0 0.1rem 0;
-                    letter-spacing: 0.02em;
-                }
-                .expired { color: #dc3545; }
-                .back-link {
-                    display: inline-block;
-                    margin-top: 0.7rem;
-                    color: #b6f5c6;
-                    text-decoration: none;
-                    font-weight: 500;
-                    font-size: 1.5rem;
-                    transition: color 0.2s;
-                }
-                .back-link:hover { color: #4ecb7a; }
-                @media (max-width: 600px) {
-                    .container { padding: 0.7rem 0.2rem; min-height: 99vh; }
-                    .philosophy-block { font-size: 0.98em; }
-                    .qr-box img { width: 90vw; max-width: 98vw; }
-                }
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <div class="philosophy-title">Философия клиники «Гирудомед»</div>
-                <div class="philosophy-block" id="philosophy-text"></div>
-                <h2>Филиал: {{branch['name']}}</h2>
-                <div class="qr-box">
-                    <img id="qr-image" src="/qr_image?branch_id={{branch['id']}}&t=" alt="QR-код" />
-                </div>
-                <div class="timer">
-                    <span id="timer">Обновление через: <span id="countdown">30</span> сек</span>
-                </div>
-                <div style="font-size:0.97rem;color:#b6f5c6;margin-top:0.1rem;">QR-код действителен 1 минуту</div>
-                <a class="back-link" href="/">←</a>
-            </div>
-            <script>
-                // Философия из Python
-                const philosophyPoints = {{ philosophy_points|tojson }};
-                let philosophyBlock = document.getElementById('philosophy-text');
-                
-                function getRandomPhilosophy() {
-                    const randomIndex = Math.floor(Math.random() * philosophyPoints.length);
-                    const pointNumber = randomIndex + 1;
-                    
-                    // Плавная смена текста с адаптацией размера
-                    philosophyBlock.style.opacity = '0.6';
-                    philosophyBlock.style.transform = 'scale(0.98)';
-                    
-                    setTimeout(() => {
-                        philosophyBlock.textContent = `${pointNumber}. ${philosophyPoints[randomIndex]}`;
-                        
-                        // Возвращаем нормальное состояние
-                        philosophyBlock.style.opacity = '1';
-                        philosophyBlock.style.transform = 'scale(1)';
-                    }, 200);
-                }
-                
-                getRandomPhilosophy();
-                setInterval(getRandomPhilosophy, 15000);
+            image, mimetype = qr_render.render_image(item["payload"], output)
+            item["image"] = f"data:{mimetype};base64," + base64.b64encode(image).decode()
+        items.append(item)
 
-                let countdown = 30;
-                let timerElement = document.getElementById('countdown');
-                let qrImage = document.getElementById('qr-image');
-                let branchId = {{branch['id']}};
-                
-                function updateQR() {
-                    qrImage.src = '/qr_image?branch_id=' + branchId + '&t=' + Date.now();
-                    countdown = 30;
-                }
-                
-                function updateTimer() {
-                    timerElement.textContent = countdown;
-                    countdown--;
-                    if (countdown < 0) {
-                        updateQR();
-                    }
-                }
-                
-                setInterval(updateTimer, 1000);
-                setInterval(updateQR, 30000);
-            </script>
-        </body>
-        </html>
-        """, branch=branch, qr_data=qr_data, philosophy_points=philosophy_points
-    )
+    response = jsonify({
+        "branch_id": branch_id,
+        "server_time": int(time.time() * 1000),
+        "window_seconds": QR_TIME_WINDOW,
+        "items": items,
+    })
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+@app.route("/qr_matrix")
+def qr_matrix():
+    """Текущий QR филиала как упакованная матрица модулей (без PIL и PNG)"""
+    auth_check = require_auth()
+    if auth_check:
+        return auth_check
+
+    branch_id = request.args.get("branch_id", type=int)
+    if not branch_id:
+        return "Не выбран филиал", 400
+    time_window = get_window_arg()
+    if time_window is None:
+        return "Недопустимое окно", 400
+    etag = f"m{QR_PAYLOAD_VERSION}-{branch_id}-{time_window}"
+    cached = not_modified(etag, time_window)
+    if cached:
+        return cached
+
+    matrix = qr_matrix_cache.get(branch_id, time_window)
+    if matrix is None:
+        branch = branch_catalog.get(branch_id)
+        if not branch:
+            return "Филиал не найден", 404
+
+        def render():
+            qr_data = generate_qr_payload(branch_id, branch["name"], time_window * QR_TIME_WINDOW)
+            if not qr_data:
+                return None
+            return dict(qr_render.render_matrix(f"/qr_{qr_data}"), window=time_window)
+
+        matrix = cached_window_render(qr_matrix_cache, branch_id, time_window, render)
+        if matrix is None:
+            return "Ошибка генерации QR-кода", 500
+    return window_cache_headers(jsonify(matrix), etag, time_window)
 
 @app.route("/qr_image")
 def qr_image():
@@ -450,26 +978,55 @@ def qr_image():
     # Поддержка старого формата (data) и нового (branch_id)
     data = request.args.get("data", "")
     branch_id = request.args.get("branch_id", type=int)
+    engine = get_engine_arg()
+    if not engine:
+        return "Неизвестный движок рендера", 400
     
     if data:
         # Старый формат - используем готовые данные
         qr_full = f"/qr_{data}"
     elif branch_id:
-        # Новый формат - генерируем QR по branch_id
-        branches = get_branches()
-        branch = next((b for b in branches if b["id"] == branch_id), None)
-        if not branch:
-            return "Филиал не найден", 404
-        qr_data = generate_qr_payload(branch_id, branch["name"])
-        qr_full = f"/qr_{qr_data}"
+        # Новый формат - QR по branch_id и окну, один рендер на окно
+        time_window = get_window_arg()
+        if time_window is None:
+            return "Недопустимое окно", 400
+        return window_image_response(branch_id, time_window, engine)
     else:
         return "Нет данных для QR", 400
     
-    qr_img = qrcode.make(qr_full)
-    img_io = io.BytesIO()
-    qr_img.save(img_io, 'PNG')
-    img_io.seek(0)
-    return send_file(img_io, mimetype='image/png')
+    image, mimetype = qr_render.render_image(qr_full, engine)
+    return send_file(io.BytesIO(image), mimetype=mimetype)
+
+@app.route("/qr_image/<int:branch_id>/<int:time_window>/<int:expires>/<signature>.<engine>")
+def qr_image_signed(branch_id, time_window, expires, signature, engine):
+    """Картинка QR по подписанной ссылке: без сессии, с публичными заголовками кэша.
+
+    Сессию здесь не трогаем, иначе Flask добавит Vary: Cookie и прокси
+    не сможет отдавать один ответ всем киоскам филиала.
+    """
+    if engine not in qr_render.ENGINES:
+        return "Неизвестный движок рендера", 404
+    expected = sign_image_url(branch_id, time_window, engine, expires)
+    if not hmac.compare_digest(signature, expected):
+        return "Неверная подпись ссылки", 403
+    if expires < get_moscow_timestamp():
+        return "Ссылка устарела", 410
+    return window_image_response(branch_id, time_window, engine, public=True)
+
+@app.route("/scanner")
+def scanner():
+    """Telegram Mini App: QR читается камерой телефона прямо в браузере.
+
+    Открывается кнопкой бота (SCANNER_WEBAPP_URL), текст кода
+    отправляется боту через Telegram.WebApp.sendData. Сессия не нужна:
+    страница статична, а код проверяет бот.
+    """
+    body = render_page(
+        SCANNER_TEMPLATE, qr_prefix=qr_payload.QR_PREFIX, jsqr_url=JSQR_URL, jsqr_integrity=JSQR_INTEGRITY
+    )
+    response = Response(body, mimetype="text/html")
+    response.headers["Cache-Control"] = f"public, max-age={SCANNER_MAX_AGE}"
+    return response
 
 if __name__ == "__main__":
     app.run("0.0.0.0", 8080, debug=True)
@@ -0,0 +1,84 @@
+# qr_cache.py
+import threading
+from collections import OrderedDict
+
+
+class QRWindowCache:
+    """Кэш готовых QR-изображений по ключу (branch_id, time_window).
+
+    Картинка для филиала меняется только раз в окно (30 секунд), поэтому
+    рендер выполняется один раз на окно, а все остальные запросы получают
+    готовые байты. Параллельные промахи по одному ключу схлопываются:
+    рендерит первый поток, остальные ждут его результата.
+    """
+
+    def __init__(self, max_entries=64, keep_windows=2, wait_timeout=10.0):
+        self.max_entries = max_entries
+        self.keep_windows = keep_windows
+        self.wait_timeout = wait_timeout
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def get(self, branch_id, time_window):
+        """Вернуть закэшированные байты или None"""
+        key = (branch_id, time_window)
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def get_or_render(self, branch_id, time_window, render):
+        """Вернуть байты из кэша, при промахе выполнить render() один раз"""
+        key = (branch_id, time_window)
+        while True:
+            with self._lock:
+                value = self._entries.get(key)
+                if value is not None:
+                    self._entries.move_to_end(key)
+                    return value
+                event = self._inflight.get(key)
+                owner = event is None
+                if owner:
+                    event = threading.Event()
+                    self._inflight[key] = event
+
+            if not owner:
+                # Рендер уже идёт в другом потоке — ждём и перечитываем кэш.
+                # Если владелец упал, следующий круг цикла возьмёт рендер на себя.
+                if not event.wait(self.wait_timeout):
+                    return render()
+                continue
+
+            value = None
+            try:
+                value = render()
+                return value
+            finally:
+                with self._lock:
+                    self._inflight.pop(key, None)
+                    if value is not None:
+                        self._store(key, value)
+                event.set()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _store(self, key, value):
+        """Сохранить значение и вытеснить устаревшие окна (вызывать под локом)"""
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+
+        newest_window = max(k[1] for k in self._entries)
+        oldest_allowed = newest_window - self.keep_windows + 1
+        for stale_key in [k for k in self._entries if k[1] < oldest_allowed]:
+            del self._entries[stale_key]
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
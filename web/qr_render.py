@@ -0,0 +1,112 @@
+# qr_render.py
+"""Движки рендера QR-кода для киосков: PNG-профили, SVG и матрица модулей."""
+
+import base64
+import io
+from collections import namedtuple
+
+import qrcode
+from PIL import Image
+
+ERROR_CORRECTION = {
+    "L": qrcode.constants.ERROR_CORRECT_L,
+    "M": qrcode.constants.ERROR_CORRECT_M,
+    "Q": qrcode.constants.ERROR_CORRECT_Q,
+    "H": qrcode.constants.ERROR_CORRECT_H,
+}
+
+PngProfile = namedtuple("PngProfile", "box_size border error_correction")
+
+PNG_PROFILES = {
+    # То же, что qrcode.make(): крупные модули, рамка 4, коррекция M
+    "default": PngProfile(box_size=10, border=4, error_correction="M"),
+    # Экран киоска: картинка всё равно масштабируется CSS, хватает 8 px на модуль
+    "kiosk": PngProfile(box_size=8, border=4, error_correction="M"),
+    # Для экранов с бликами: больше избыточности ценой версии QR
+    "robust": PngProfile(box_size=8, border=4, error_correction="Q"),
+}
+DEFAULT_PNG_PROFILE = "kiosk"
+
+SVG_BORDER = 4
+
+
+def build_modules(qr_full, error_correction="M"):
+    """Матрица модулей QR (список строк из bool) без рамки"""
+    qr = qrcode.QRCode(error_correction=ERROR_CORRECTION[error_correction], border=0)
+    qr.add_data(qr_full)
+    qr.make(fit=True)
+    return qr.version, qr.modules
+
+
+def render_png(qr_full, profile=DEFAULT_PNG_PROFILE):
+    """1-битный PNG: матрица рисуется по пикселю на модуль и растягивается NEAREST"""
+    box_size, border, error_correction = PNG_PROFILES[profile]
+    _, modules = build_modules(qr_full, error_correction)
+    size = len(modules) + border * 2
+
+    img = Image.new("1", (size, size), 1)
+    pixels = img.load()
+    for y, row in enumerate(modules, start=border):
+        for x, module in enumerate(row, start=border):
+            if module:
+                pixels[x, y] = 0
+    img = img.resize((size * box_size, size * box_size), Image.Resampling.NEAREST)
+
+    out = io.BytesIO()
+    img.save(out, "PNG")
+    return out.getvalue()
+
+
+def render_svg(qr_full, error_correction="M"):
+    """SVG из одного path: тёмные серии модулей рисуются линиями толщиной в модуль,
+    с относительными перемещениями — так разметка получается минимальной"""
+    _, modules = build_modules(qr_full, error_correction)
+    size = len(modules) + SVG_BORDER * 2
+
+    path = [f"M{SVG_BORDER} {SVG_BORDER}.5"]
+    cx, cy = SVG_BORDER, SVG_BORDER
+    for y, row in enumerate(modules, start=SVG_BORDER):
+        x = 0
+        while x < len(row):
+            if not row[x]:
+                x += 1
+                continue
+            start = x
+            while x < len(row) and row[x]:
+                x += 1
+            path.append(f"m{start + SVG_BORDER - cx} {y - cy}h{x - start}")
+            cx, cy = x + SVG_BORDER, y
+
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {size} {size}" shape-rendering="crispEdges">'
+        f'<rect width="{size}" height="{size}" fill="#fff"/>'
+        f'<path d="{"".join(path)}" stroke="#000"/></svg>'
+    ).encode()
+
+
+def render_matrix(qr_full, error_correction="M"):
+    """Матрица модулей: base64 от битов построчно (старший бит первым), без рамки"""
+    version, modules = build_modules(qr_full, error_correction)
+    size = len(modules)
+    bits = bytearray((size * size + 7) // 8)
+    index = 0
+    for row in modules:
+        for module in row:
+            if module:
+                bits[index >> 3] |= 0x80 >> (index & 7)
+            index += 1
+    return {"version": version, "size": size, "bits": base64.b64encode(bytes(bits)).decode()}
+
+
+# Движки для /qr_image: имя → (функция рендера, MIME-тип)
+ENGINES = {
+    "png": (render_png, "image/png"),
+    "svg": (render_svg, "image/svg+xml"),
+}
+DEFAULT_ENGINE = "png"
+
+
+def render_image(qr_full, engine=DEFAULT_ENGINE):
+    """Отрендерить QR выбранным движком, вернуть (байты, MIME-тип)"""
+    render, mimetype = ENGINES[engine]
+    return render(qr_full), mimetype